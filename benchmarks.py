@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the scheduling, locking and logging hot paths of django_cron.
+
+Runs on a test database created from the settings module, like runtests.py:
+
+    python benchmarks.py --output 0.5.0.json
+    DJANGO_SETTINGS_MODULE=settings_postgres python benchmarks.py --log-rows 10000,1000000,10000000
+
+The results are written as JSON. Compare two result files with:
+
+    python benchmarks.py --compare 0.4.1.json 0.5.0.json
+
+which exits with status 1 when a benchmark got slower than --threshold.
+"""
+from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import types
+
+if 'DJANGO_SETTINGS_MODULE' not in os.environ:
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings_sqllite'
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARK_MODULE = 'django_cron_benchmark_jobs'
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure(func, repeat):
+    """
+    Calls func `repeat` times and returns the durations, in seconds.
+    """
+    durations = []
+    for i in range(repeat):
+        started = timeit.default_timer()
+        func()
+        durations.append(timeit.default_timer() - started)
+    return durations
+
+
+def count_queries(func):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    return len(queries)
+
+
+def make_result(name, durations, operations=1, queries=None, **params):
+    """
+    @durations  - seconds taken by each repetition
+    @operations - number of operations (runs, locks, rows...) of a repetition
+    """
+    return {
+        'name': name,
+        'params': params,
+        'repeat': len(durations),
+        'operations': operations,
+        'min': min(durations),
+        'median': median(durations),
+        'operations_per_second': operations / median(durations) if median(durations) else None,
+        'queries': queries,
+    }
+
+
+def make_cron_classes(count):
+    """
+    Returns `count` cron classes with a mix of schedules, importable from
+    BENCHMARK_MODULE so that they can be listed in CRON_CLASSES.
+    """
+    from django_cron import CronJobBase, Schedule
+
+    module = sys.modules.setdefault(BENCHMARK_MODULE, types.ModuleType(BENCHMARK_MODULE))
+    schedules = [
+        Schedule(run_every_mins=60, retry_after_failure_mins=5),
+        Schedule(run_at_times=['03:00', '15:00']),
+        Schedule(cron_expression='0 */6 * * *'),
+    ]
+    cron_classes = []
+    for i in range(count):
+        name = 'BenchmarkCronJob%s' % i
+        cron_class = type(name, (CronJobBase,), {
+            '__module__': BENCHMARK_MODULE,
+            'code': 'benchmark.%s' % i,
+            'schedule': schedules[i % len(schedules)],
+            'do': lambda self: None,
+        })
+        setattr(module, name, cron_class)
+        cron_classes.append(cron_class)
+    return cron_classes
+
+
+def populate_logs(cron_classes, rows, batch_size=10000):
+    """
+    Grows CronJobLog to `rows` rows, spread over the given cron classes,
+    one run every 10 minutes going back in time. Every tenth job failed its
+    last 10 runs, so FailedRunsNotificationCronJob has something to report.
+    """
+    from django.utils import timezone
+    from django_cron.models import CronJobLog, CronJobState
+
+    existing = CronJobLog.objects.count()
+    now = timezone.now()
+    batch = []
+    for i in range(existing, rows):
+        job_index = i % len(cron_classes)
+        run_index = i // len(cron_classes)
+        start_time = now - timedelta(minutes=10 * (run_index + 1))
+        batch.append(CronJobLog(
+            code=cron_classes[job_index].code,
+            start_time=start_time,
+            end_time=start_time + timedelta(seconds=1),
+            is_success=not (job_index % 10 == 0 and run_index < 10),
+            message='',
+        ))
+        if len(batch) == batch_size:
+            CronJobLog.objects.bulk_create(batch)
+            batch = []
+    CronJobLog.objects.bulk_create(batch)
+    # Rebuilt from the logs on the first schedule evaluation
+    CronJobState.objects.all().delete()
+
+
+def bench_should_run_now(cron_classes, log_rows, job_counts, repeat):
+    from django_cron import CronJobManager
+    from django_cron.scheduler import CronJobScheduler
+
+    results = []
+    for rows in log_rows:
+        log('Populating %s log rows' % rows)
+        populate_logs(cron_classes, rows)
+        for count in job_counts:
+            subset = cron_classes[:count]
+            scheduler = CronJobScheduler(subset)
+
+            def evaluate_batch():
+                scheduler.get_due_cron_classes()
+
+            def evaluate_per_job():
+                for cron_class in subset:
+                    CronJobManager(cron_class).should_run_now()
+
+            log('should_run_now: %s jobs, %s log rows' % (count, rows))
+            # The first evaluation rebuilds the missing CronJobState rows
+            cold = measure(evaluate_batch, 1)
+            results.append(make_result('should_run_now.cold', cold, count, jobs=count, log_rows=rows))
+            results.append(make_result(
+                'should_run_now.batch', measure(evaluate_batch, repeat), count,
+                count_queries(evaluate_batch), jobs=count, log_rows=rows
+            ))
+            results.append(make_result(
+                'should_run_now.per_job', measure(evaluate_per_job, repeat), count,
+                count_queries(evaluate_per_job), jobs=count, log_rows=rows
+            ))
+    return results
+
+
+def bench_locks(cron_classes, iterations, repeat):
+    from django_cron.backends.lock.cache import CacheLock
+    from django_cron.backends.lock.database import DatabaseLock
+    from django_cron.backends.lock.file import FileLock
+
+    results = []
+    for lock_class in (CacheLock, FileLock, DatabaseLock):
+        lock = lock_class(cron_classes[0], True)
+
+        def lock_release():
+            for i in range(iterations):
+                if not lock.lock():
+                    raise Exception('%s is already locked' % lock.job_code)
+                lock.release()
+
+        name = lock_class.__name__
+        log('%s.lock/release' % name)
+        results.append(make_result(
+            'lock.lock_release', measure(lock_release, repeat), iterations, count_queries(lock_release), backend=name
+        ))
+
+        lock_classes = cron_classes[:100]
+
+        def lock_many():
+            locks = lock_class.lock_many(lock_classes, True)
+            lock_class.release_many(locks)
+
+        log('%s.lock_many/release_many' % name)
+        results.append(make_result(
+            'lock.lock_many', measure(lock_many, repeat), len(lock_classes), count_queries(lock_many), backend=name
+        ))
+    return results
+
+
+def bench_make_log(cron_classes, iterations, repeat):
+    from django.test.utils import override_settings
+    from django_cron import CronJobManager
+    from django_cron.log_buffer import flush_log_buffer
+
+    manager = CronJobManager(cron_classes[0], True)
+
+    def make_logs():
+        for i in range(iterations):
+            with manager:
+                manager.make_log('Benchmark run %s' % i, success=True)
+        flush_log_buffer()
+
+    log('make_log')
+    results = [make_result('make_log', measure(make_logs, repeat), iterations, count_queries(make_logs))]
+    with override_settings(DJANGO_CRON_LOG_BUFFER_INTERVAL=3600):
+        log('make_log with DJANGO_CRON_LOG_BUFFER_INTERVAL')
+        results.append(make_result(
+            'make_log.buffered', measure(make_logs, repeat), iterations, count_queries(make_logs)
+        ))
+    return results
+
+
+def bench_failed_runs_notification(cron_classes, job_counts, repeat):
+    from django.test.utils import override_settings
+    from django_cron.cron import FailedRunsNotificationCronJob
+    from django_cron.models import CronJobState
+
+    results = []
+    for count in job_counts:
+        cron_class_names = ['%s.%s' % (BENCHMARK_MODULE, cron_class.__name__) for cron_class in cron_classes[:count]]
+        with override_settings(CRON_CLASSES=cron_class_names, ADMINS=[('Admin', 'admin@example.com')]):
+            cron_job = FailedRunsNotificationCronJob()
+            log('FailedRunsNotificationCronJob.do: %s jobs' % count)
+            CronJobState.objects.all().delete()
+            cold = measure(cron_job.do, 1)
+            results.append(make_result('failed_runs_notification.cold', cold, count, jobs=count))
+            results.append(make_result(
+                'failed_runs_notification', measure(cron_job.do, repeat), count, count_queries(cron_job.do), jobs=count
+            ))
+    return results
+
+
+def run_benchmarks(options):
+    import django
+    from django.conf import settings
+    from django.db import connection
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    if hasattr(django, 'setup'):
+        django.setup()
+
+    # Emails sent by FailedRunsNotificationCronJob stay in memory
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        cron_classes = make_cron_classes(max(options.jobs))
+        results = []
+        results.extend(bench_locks(cron_classes, options.iterations, options.repeat))
+        results.extend(bench_make_log(cron_classes, options.iterations, options.repeat))
+        results.extend(bench_should_run_now(cron_classes, options.log_rows, options.jobs, options.repeat))
+        results.extend(bench_failed_runs_notification(cron_classes, options.jobs, options.repeat))
+        vendor = connection.vendor
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    return {
+        'label': options.label,
+        'date': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'settings': os.environ['DJANGO_SETTINGS_MODULE'],
+        'database': vendor,
+        'cache': settings.CACHES['default']['BACKEND'],
+        'results': results,
+    }
+
+
+def get_key(result):
+    return (result['name'], tuple(sorted(result['params'].items())))
+
+
+def compare(old_path, new_path, threshold):
+    """
+    Prints the ratio of the median times of the benchmarks found in both
+    files, and returns the number of those slower than `threshold`.
+    """
+    with open(old_path) as f:
+        old = dict((get_key(result), result) for result in json.load(f)['results'])
+    with open(new_path) as f:
+        new = json.load(f)['results']
+
+    regressions = 0
+    for result in new:
+        old_result = old.get(get_key(result))
+        if old_result is None or not old_result['median']:
+            continue
+        ratio = result['median'] / old_result['median']
+        params = ', '.join('%s=%s' % item for item in sorted(result['params'].items()))
+        flag = ''
+        if ratio > threshold:
+            regressions += 1
+            flag = '  REGRESSION'
+        print('%-32s %-36s %10.6f -> %10.6f  x%.2f%s' % (
+            result['name'], params, old_result['median'], result['median'], ratio, flag
+        ))
+    return regressions
+
+
+def log(message):
+    sys.stderr.write(message + '\n')
+
+
+def parse_ints(value):
+    return [int(x) for x in value.split(',') if x]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=parse_ints, default=[10, 100, 1000], help='Numbers of cron jobs, default: 10,100,1000')
+    parser.add_argument('--log-rows', type=parse_ints, default=[10000, 100000], help='Sizes of the CronJobLog table, default: 10000,100000')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions of each benchmark, default: 5')
+    parser.add_argument('--iterations', type=int, default=100, help='Locks and logs per repetition, default: 100')
+    parser.add_argument('--label', default='', help='Name of this run, e.g. the version or commit')
+    parser.add_argument('--output', help='File to write the JSON results to, default: stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Slowdown ratio reported as a regression, default: 1.2')
+    options = parser.parse_args(argv)
+
+    if options.compare:
+        return 1 if compare(options.compare[0], options.compare[1], options.threshold) else 0
+
+    report = json.dumps(run_benchmarks(options), indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
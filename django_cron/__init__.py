@@ -1,17 +1,35 @@
 import logging
+from collections import namedtuple
 from datetime import timedelta
-import traceback
+import hashlib
 import time
+import traceback
 
-from django_cron.models import CronJobLog
+from django_cron.aio import is_async_job, is_coroutine, run_coroutine
+from django_cron.crontab import CronExpression
+from django_cron.log_buffer import get_log_buffer
+from django_cron import metrics
+from django_cron.models import CronJobLog, CronJobState
+from django_cron.output import MAX_MESSAGE_LENGTH, CronJobOutput, get_output_storage
+from django_cron.pool import CronJobPool
+from django_cron.run_state import CronJobRunState, parse_run_at_time
+from django_cron.stats import CronJobRunStats
+from django_cron.timeout import CronJobSubprocessError, CronJobTimeout, can_enforce_timeout, run_with_timeout
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from django.db.models import Q
 
 
 DEFAULT_LOCK_BACKEND = 'django_cron.backends.lock.cache.CacheLock'
+# Failed runs without retry_after_failure_mins are retried once a minute, as by runcrons started from crontab
+FAILED_RUN_RETRY_DELAY = timedelta(minutes=1)
 logger = logging.getLogger('django_cron')
 
+default_app_config = 'django_cron.apps.DjangoCronConfig'
+
+# Classes already converted by get_class, by path
+class_cache = {}
+
 
 def get_class(kls):
     """
@@ -19,21 +37,53 @@ def get_class(kls):
     Converts a string to a class.
     Courtesy: http://stackoverflow.com/questions/452969/does-python-have-an-equivalent-to-java-class-forname/452981#452981
     """
+    if kls in class_cache:
+        return class_cache[kls]
+
     parts = kls.split('.')
     module = ".".join(parts[:-1])
     m = __import__(module)
     for comp in parts[1:]:
         m = getattr(m, comp)
+    class_cache[kls] = m
     return m
 
 
+RunAtTime = namedtuple('RunAtTime', ['time_data', 'time', 'expression'])
+
+
 class Schedule(object):
-    def __init__(self, run_every_mins=None, run_at_times=None, retry_after_failure_mins=None):
+    """
+    When a cron job should run. Any combination of:
+    + run_every_mins - run again X minutes after the last successful run
+    + run_at_times - run once a day at each of the given "HH:MM" times
+    + cron_expression - crontab-style expression, eg. '*/15 9-17 * * mon-fri'
+    + retry_after_failure_mins - wait X minutes before retrying a failed run
+
+    Times and cron expressions are compiled once, when the schedule is
+    created (usually when the cron class is defined).
+    """
+    def __init__(self, run_every_mins=None, run_at_times=None, retry_after_failure_mins=None, cron_expression=None):
         if run_at_times is None:
             run_at_times = []
+        if cron_expression is not None and not isinstance(cron_expression, CronExpression):
+            cron_expression = CronExpression(cron_expression)
         self.run_every_mins = run_every_mins
         self.run_at_times = run_at_times
         self.retry_after_failure_mins = retry_after_failure_mins
+        self.cron_expression = cron_expression
+
+        self.compiled_run_at_times = []
+        for time_data in run_at_times:
+            run_time = parse_run_at_time(time_data)
+            self.compiled_run_at_times.append(RunAtTime(time_data, run_time, CronExpression.from_time(run_time)))
+
+    @property
+    def runs_after_last_run(self):
+        """
+        True when the schedule depends on the last (successful) run of the job
+        """
+        return self.run_every_mins is not None or self.cron_expression is not None
 
 
 class CronJobBase(object):
@@ -43,10 +93,25 @@ class CronJobBase(object):
     + schedule
 
     Following functions:
-    + do - This is the actual business logic to be run at the given schedule
+    + do - This is the actual business logic to be run at the given schedule.
+      It can be a coroutine function (`async def do(self)`, Python 3.5+): runcrons
+      then runs it concurrently with the other async jobs on one event loop.
+
+    Optional properties:
+    + TIMEOUT_SECONDS - do() is stopped after this number of seconds (default:
+      DJANGO_CRON_TIMEOUT) and the run is logged as failed. A sync do() then runs
+      in a child process, killed when the time is up; async ones are cancelled.
+
+    + DEPENDS_ON - codes of the jobs this one runs after: it needs no
+      schedule, and is due once the latest run of each of them succeeded
+      after its own last success. runcrons starts it as soon as they succeed.
+
+    do() can write its output to self.output (a CronJobOutput), the end of
+    which is logged with the run.
     """
     def __init__(self):
         self.prev_success_cron = None
+        self.output = CronJobOutput(getattr(self, 'code', None))
 
     def set_prev_success_cron(self, prev_success_cron):
         self.prev_success_cron = prev_success_cron
@@ -55,6 +120,34 @@ class CronJobBase(object):
         return self.prev_success_cron
 
 
+class ShardedCronJobBase(CronJobBase):
+    """
+    A cron job whose work is split in shards, run concurrently: do(shard)
+    is called once per shard, in a pool of threads.
+
+    Optional properties:
+    + SHARDS - number of shards, do() gets the shards 0 to SHARDS - 1.
+      Override get_shards() to return other shard keys instead.
+    + SHARD_WORKERS - number of shards run at once, default: all of them
+
+    Every shard runs under its own lock and gets its own CronJobLog row, with
+    the code "<code>.<shard>". When that is longer than CronJobLog.code
+    allows, the shard is replaced by a hash, and the code is cut if still
+    too long. TIMEOUT_SECONDS applies to each shard.
+    The job itself gets a row summing the shards up, successful if all of them
+    succeeded. A shard whose previous run still holds its lock is skipped,
+    and counts as failed.
+    """
+    SHARDS = 1
+    SHARD_WORKERS = None
+
+    def get_shards(self):
+        return range(self.SHARDS)
+
+    def do(self, shard):
+        raise NotImplementedError('You have to implement do(self, shard) method for your class')
+
+
 class CronJobManager(object):
     """
     A manager instance should be created per cron job to be run.
@@ -63,19 +156,26 @@ class CronJobManager(object):
     proper logger in cases of job failure.
     """
 
-    def __init__(self, cron_job_class, silent=False, *args, **kwargs):
+    def __init__(self, cron_job_class, silent=False, run_state=None, lock=None, event_loop=None, *args, **kwargs):
         super(CronJobManager, self).__init__(*args, **kwargs)
 
         self.cron_job_class = cron_job_class
         self.silent = silent
+        self.run_state = run_state
+        self.lock = lock
+        self.event_loop = event_loop
         self.lock_class = self.get_lock_class()
         self.previously_ran_successful_cron = None
 
     def should_run_now(self, force=False):
-        cron_job = self.cron_job
         """
         Returns a boolean determining whether this cron should run now or not!
+
+        Previous runs are read from self.run_state when the manager was given
+        one (see django_cron.scheduler.CronJobScheduler), otherwise they are
+        loaded from the database for this job only.
         """
+        cron_job = getattr(self, 'cron_job', self.cron_job_class)
 
         self.user_time = None
         self.previously_ran_successful_cron = None
@@ -83,55 +183,143 @@ class CronJobManager(object):
         # If we pass --force options, we force cron run
         if force:
             return True
-        if cron_job.schedule.run_every_mins is not None:
+
+        run_state = self.run_state
+        if run_state is None:
+            run_state = CronJobRunState.load([cron_job])
+        now = run_state.now
+
+        if getattr(cron_job, 'DEPENDS_ON', None):
+            self.previously_ran_successful_cron = run_state.get_last_success(cron_job.code)
+            return self.upstream_jobs_succeeded(run_state)
+
+        schedule = cron_job.schedule
+
+        if schedule.runs_after_last_run:
 
             # We check last job - success or not
-            last_job = None
-            try:
-                last_job = CronJobLog.objects.filter(code=cron_job.code).latest('start_time')
-            except CronJobLog.DoesNotExist:
-                pass
+            last_job = run_state.get_last_job(cron_job.code)
             if last_job:
-                if not last_job.is_success and cron_job.schedule.retry_after_failure_mins:
-                    if timezone.now() > last_job.start_time + timedelta(minutes=cron_job.schedule.retry_after_failure_mins):
+                if not last_job.is_success and schedule.retry_after_failure_mins:
+                    if now > last_job.start_time + timedelta(minutes=schedule.retry_after_failure_mins):
                         return True
                     else:
                         return False
 
-            try:
-                self.previously_ran_successful_cron = CronJobLog.objects.filter(
-                    code=cron_job.code,
-                    is_success=True,
-                    ran_at_time__isnull=True
-                ).latest('start_time')
-            except CronJobLog.DoesNotExist:
-                pass
-
-            if self.previously_ran_successful_cron:
-                if timezone.now() > self.previously_ran_successful_cron.start_time + timedelta(minutes=cron_job.schedule.run_every_mins):
+            self.previously_ran_successful_cron = run_state.get_last_success(cron_job.code)
+
+            if schedule.run_every_mins is not None:
+                if self.previously_ran_successful_cron:
+                    if now > self.previously_ran_successful_cron.start_time + timedelta(minutes=schedule.run_every_mins):
+                        return True
+                else:
                     return True
-            else:
-                return True
-
-        if cron_job.schedule.run_at_times:
-            for time_data in cron_job.schedule.run_at_times:
-                user_time = time.strptime(time_data, "%H:%M")
-                now = timezone.now()
-                actual_time = time.strptime("%s:%s" % (now.hour, now.minute), "%H:%M")
-                if actual_time >= user_time:
-                    qset = CronJobLog.objects.filter(
-                        code=cron_job.code,
-                        ran_at_time=time_data,
-                        is_success=True
-                    ).filter(
-                        Q(start_time__gt=now) | Q(end_time__gte=now.replace(hour=0, minute=0, second=0, microsecond=0))
-                    )
-                    if not qset:
-                        self.user_time = time_data
+
+            if schedule.cron_expression is not None:
+                next_run_time = self.get_next_cron_expression_run_time(self.previously_ran_successful_cron, now)
+                if next_run_time is not None and next_run_time <= now:
+                    return True
+
+        if schedule.compiled_run_at_times:
+            start_of_day = self.get_start_of_day(now)
+            for run_at_time in schedule.compiled_run_at_times:
+                if run_at_time.expression.get_next_run_time(start_of_day) <= now:
+                    if not run_state.has_ran_at_time(cron_job.code, run_at_time.time):
+                        self.user_time = run_at_time.time_data
                         return True
 
         return False
 
+    def next_run_time(self, now=None):
+        """
+        Returns the earliest datetime at which should_run_now may return True,
+        or None if the job has nothing scheduled. A value in the past means
+        that the job is due now.
+        """
+        cron_job = getattr(self, 'cron_job', self.cron_job_class)
+
+        run_state = self.run_state
+        if run_state is None:
+            run_state = CronJobRunState.load([cron_job], now)
+        if now is None:
+            now = run_state.now
+
+        if getattr(cron_job, 'DEPENDS_ON', None):
+            # Not known in advance, the job runs after its upstream jobs
+            return self.delay_after_failure(now if self.upstream_jobs_succeeded(run_state) else None, run_state)
+
+        schedule = cron_job.schedule
+        next_run_times = []
+        if schedule.runs_after_last_run:
+            last_job = run_state.get_last_job(cron_job.code)
+            if last_job and not last_job.is_success and schedule.retry_after_failure_mins:
+                return last_job.start_time + timedelta(minutes=schedule.retry_after_failure_mins)
+
+            last_success = run_state.get_last_success(cron_job.code)
+            if schedule.run_every_mins is not None:
+                if last_success:
+                    next_run_times.append(last_success.start_time + timedelta(minutes=schedule.run_every_mins))
+                else:
+                    next_run_times.append(now)
+
+            if schedule.cron_expression is not None:
+                next_run_times.append(self.get_next_cron_expression_run_time(last_success, now))
+
+        start_of_day = self.get_start_of_day(now)
+        for run_at_time in schedule.compiled_run_at_times:
+            if run_state.has_ran_at_time(cron_job.code, run_at_time.time):
+                next_run_times.append(run_at_time.expression.get_next_run_time(start_of_day + timedelta(days=1)))
+            else:
+                next_run_times.append(run_at_time.expression.get_next_run_time(start_of_day))
+
+        next_run_times = [x for x in next_run_times if x is not None]
+        return self.delay_after_failure(min(next_run_times) if next_run_times else None, run_state)
+
+    def delay_after_failure(self, next_run_time, run_state):
+        """
+        Returns the next run time, not earlier than FAILED_RUN_RETRY_DELAY
+        after the last run when it failed: the time a failed job was due
+        has already passed.
+        """
+        cron_job = getattr(self, 'cron_job', self.cron_job_class)
+        last_job = run_state.get_last_job(cron_job.code)
+        if next_run_time is None or last_job is None or last_job.is_success:
+            return next_run_time
+        return max(next_run_time, last_job.start_time + FAILED_RUN_RETRY_DELAY)
+
+    def upstream_jobs_succeeded(self, run_state):
+        """
+        Returns True when the latest run of every job of DEPENDS_ON succeeded,
+        and ended after the start of the last success of this job.
+        """
+        cron_job = getattr(self, 'cron_job', self.cron_job_class)
+        last_success = run_state.get_last_success(cron_job.code)
+        for code in cron_job.DEPENDS_ON:
+            last_job = run_state.get_last_job(code)
+            if last_job is None or not last_job.is_success:
+                return False
+            if last_success is not None and last_job.end_time <= last_success.start_time:
+                return False
+        return True
+
+    def get_next_cron_expression_run_time(self, last_success, now):
+        """
+        Returns the first time the cron expression matches after the last
+        successful run, or since the start of the day if the job never ran.
+        """
+        cron_job = getattr(self, 'cron_job', self.cron_job_class)
+        if last_success:
+            return cron_job.schedule.cron_expression.get_next_run_time(last_success.start_time)
+        return cron_job.schedule.cron_expression.get_next_run_time(self.get_start_of_day(now))
+
+    @staticmethod
+    def get_start_of_day(now):
+        """
+        Returns the minute before midnight, so that get_next_run_time()
+        of a cron expression also matches midnight itself.
+        """
+        return now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(minutes=1)
+
     def make_log(self, *messages, **kwargs):
         cron_log = self.cron_log
 
@@ -139,28 +327,51 @@ class CronJobManager(object):
         cron_log.code = cron_job.code
 
         cron_log.is_success = kwargs.get('success', True)
-        cron_log.message = self.make_log_msg(*messages)
-        cron_log.ran_at_time = getattr(self, 'user_time', None)
+        output = getattr(self, 'output', None)
+        if output is not None:
+            output_name = output.save()
+            # Where to find the full output first, the end of the output last
+            messages = ('Full output: %s' % output_name if output_name else '',) + messages + (output.getvalue(),)
+        cron_log.message = self.make_log_msg(*([x for x in messages if x] or ['']))
+        user_time = getattr(self, 'user_time', None)
+        cron_log.ran_at_time = parse_run_at_time(user_time) if user_time else None
         cron_log.end_time = timezone.now()
-        cron_log.save()
+        stats = getattr(self, 'stats', None)
+        if stats is not None:
+            stats.apply(cron_log)
+
+        metrics.increment('django_cron.runs', code=cron_log.code)
+        if not cron_log.is_success:
+            metrics.increment('django_cron.failures', code=cron_log.code)
+        if cron_log.do_duration is not None:
+            metrics.observe('django_cron.job_duration', cron_log.do_duration, code=cron_log.code)
+
+        log_buffer = get_log_buffer()
+        if log_buffer is not None and cron_log.is_success:
+            log_buffer.add(cron_log)
+            return
+
+        started = time.time()
+        with transaction.atomic():
+            cron_log.save()
+            CronJobState.objects.record(cron_log)
+        CronJobRunState.record(cron_log)
+        logger.debug("Cron %s logged in %.3f seconds", cron_log.code, time.time() - started)
 
     def make_log_msg(self, msg, *other_messages):
-        MAX_MESSAGE_LENGTH = 1000
-        if not other_messages:
-            # assume that msg is a single string
-            return msg[-MAX_MESSAGE_LENGTH:]
-        else:
-            if len(msg):
-                msg += "\n...\n"
-                NEXT_MESSAGE_OFFSET = MAX_MESSAGE_LENGTH - len(msg)
-            else:
-                NEXT_MESSAGE_OFFSET = MAX_MESSAGE_LENGTH
-
-            if NEXT_MESSAGE_OFFSET > 0:
-                msg += other_messages[0][-NEXT_MESSAGE_OFFSET:]
-                return self.make_log_msg(msg, *other_messages[1:])
-            else:
-                return self.make_log_msg(msg)
+        """
+        Joins the messages with "\n...\n", each one cut to the end that fits
+        in MAX_MESSAGE_LENGTH characters after the previous ones.
+        """
+        length = len(msg)
+        parts = [msg[-MAX_MESSAGE_LENGTH:]]
+        for message in other_messages:
+            separator = "\n...\n" if length else ""
+            if length + len(separator) >= MAX_MESSAGE_LENGTH:
+                break
+            parts.append(separator + message[length + len(separator) - MAX_MESSAGE_LENGTH:])
+            length += len(parts[-1])
+        return ''.join(parts)[-MAX_MESSAGE_LENGTH:]
 
     def __enter__(self):
         self.cron_log = CronJobLog(start_time=timezone.now())
@@ -169,12 +380,17 @@ class CronJobManager(object):
 
     def __exit__(self, ex_type, ex_value, ex_traceback):
         if ex_type == self.lock_class.LockFailedException:
+            metrics.increment('django_cron.lock_contention', code=self.cron_job_class.code)
             if not self.silent:
                 logger.info(ex_value)
 
         elif ex_type is not None:
             try:
-                trace = "".join(traceback.format_exception(ex_type, ex_value, ex_traceback))
+                if issubclass(ex_type, (CronJobTimeout, CronJobSubprocessError)):
+                    # The timeout marker, or the traceback of the job process
+                    trace = str(ex_value)
+                else:
+                    trace = "".join(traceback.format_exception(ex_type, ex_value, ex_traceback))
                 self.make_log(self.msg, trace, success=False)
             except Exception as e:
                 err_msg = "Error saving cronjob log message: %s" % e
@@ -186,25 +402,140 @@ class CronJobManager(object):
         """
         apply the logic of the schedule and call do() on the CronJobBase class
         """
-        cron_job_class = self.cron_job_class
+        from django_cron.registry import resolve_cron_class
+
+        # Lazily loaded classes are imported now, a failing import is logged as a failed run
+        cron_job_class = self.cron_job_class = resolve_cron_class(self.cron_job_class)
         if not issubclass(cron_job_class, CronJobBase):
             raise Exception('The cron_job to be run must be a subclass of %s' % CronJobBase.__name__)
 
-        with self.lock_class(cron_job_class, self.silent):
+        self.stats = CronJobRunStats()
+        # The lock may have been acquired beforehand, see DjangoCronJobLock.lock_many
+        lock = self.lock or self.lock_class(cron_job_class, self.silent)
+        started = time.time()
+        with lock:
+            self.stats.lock_duration = time.time() - started
             self.cron_job = cron_job_class()
 
-            if self.should_run_now(force):
+            with self.stats.measure('schedule'):
+                should_run = self.should_run_now(force)
+
+            if should_run:
                 logger.debug("Running cron: %s code %s", cron_job_class.__name__, self.cron_job.code)
-                self.msg = self.cron_job.do()
-                self.make_log(self.msg, success=True)
+                self.output = self.cron_job.output = CronJobOutput(self.cron_job.code, get_output_storage())
+                timeout = self.get_timeout()
+                success = True
+                with self.stats.measure_job():
+                    if isinstance(self.cron_job, ShardedCronJobBase):
+                        msg, success = self.run_shards()
+                    elif timeout and can_enforce_timeout() and not is_async_job(cron_job_class):
+                        msg, output_state = run_with_timeout(self.run_with_output, timeout)
+                        self.output.set_state(output_state)
+                    else:
+                        msg = self.cron_job.do()
+                    if is_coroutine(msg):
+                        msg = run_coroutine(msg, timeout, self.event_loop)
+                self.msg = msg
+                self.make_log(self.msg, success=success)
                 self.cron_job.set_prev_success_cron(self.previously_ran_successful_cron)
 
-    def get_lock_class(self):
-        name = getattr(settings, 'DJANGO_CRON_LOCK_BACKEND', DEFAULT_LOCK_BACKEND)
-        try:
-            return get_class(name)
-        except Exception as err:
-            raise Exception("invalid lock module %s. Can't use it: %s." % (name, err))
+    def run_shards(self):
+        """
+        Runs do(shard) for every shard of a ShardedCronJobBase, each one
+        like a cron job of its own (see get_shard_class), and returns the
+        message and the success of the whole job.
+        """
+        shards = list(self.cron_job.get_shards())
+        managers = {}
+
+        def run_shard(shard_class, force=True):
+            with CronJobManager(shard_class, self.silent) as manager:
+                managers[shard_class.shard] = manager
+                manager.run(force)
+
+        workers = getattr(self.cron_job, 'SHARD_WORKERS', None) or len(shards)
+        CronJobPool(workers).run(run_shard, [self.get_shard_class(shard) for shard in shards])
+
+        failed = []
+        for shard in shards:
+            manager = managers.get(shard)
+            if getattr(manager, 'output', None) is not None:
+                # The end of the output of every shard, in the order of the shards
+                self.output.write(manager.output.getvalue())
+            if manager is None or manager.cron_log.end_time is None or not manager.cron_log.is_success:
+                # Not logged when its lock was held by a previous run
+                failed.append(shard)
+
+        msg = '%s shards: %s succeeded, %s failed' % (len(shards), len(shards) - len(failed), len(failed))
+        if failed:
+            msg += ' (%s)' % ', '.join(str(shard) for shard in failed)
+        return msg, not failed
+
+    def get_shard_class(self, shard):
+        """
+        Returns a cron class running do(shard) of the current sharded job,
+        with a code (and so a lock and logs) of its own.
+
+        do(shard) is called on a new instance of the sharded job, writing to
+        the output of the shard, which is also kept when the shard runs in a
+        child process (TIMEOUT_SECONDS).
+        """
+        cron_job = self.cron_job
+        cron_job_class = self.cron_job_class
+        key = self.get_shard_key(shard)
+
+        def do(shard_job):
+            job = cron_job_class()
+            job.output = shard_job.output
+            return job.do(shard)
+
+        attrs = {
+            'code': self.get_shard_code(key),
+            'shard': shard,
+            'TIMEOUT_SECONDS': self.get_timeout(),
+            'do': do,
+            '__module__': self.cron_job_class.__module__,
+        }
+        if hasattr(cron_job, 'DJANGO_CRON_LOCK_TIME'):
+            attrs['DJANGO_CRON_LOCK_TIME'] = cron_job.DJANGO_CRON_LOCK_TIME
+        return type(str('%s_%s' % (self.cron_job_class.__name__, key)), (CronJobBase,), attrs)
+
+    def get_shard_key(self, shard):
+        """
+        Returns the shard as it appears in the code of the shard, replaced by
+        a hash of the code when it would not fit in CronJobLog.code.
+        """
+        key = '%s' % shard
+        code = '%s.%s' % (self.cron_job.code, key)
+        if len(code) > CronJobLog._meta.get_field('code').max_length:
+            key = hashlib.md5(code.encode('utf-8')).hexdigest()[:12]
+        return key
+
+    def get_shard_code(self, key):
+        """
+        Returns "<code>.<key>", cutting the code of the job to fit in CronJobLog.code.
+        """
+        max_length = CronJobLog._meta.get_field('code').max_length
+        return '%s.%s' % (self.cron_job.code[:max_length - len(key) - 1], key)
+
+    def run_with_output(self):
+        """
+        Runs do() in the child process of run_with_timeout, and returns
+        its output with its result to the parent.
+        """
+        msg = self.cron_job.do()
+        return msg, self.output.get_state()
+
+    def get_timeout(self):
+        return getattr(self.cron_job_class, 'TIMEOUT_SECONDS', getattr(settings, 'DJANGO_CRON_TIMEOUT', None))
+
+    @staticmethod
+    def get_lock_class():
+        """
+        The DJANGO_CRON_LOCK_BACKEND class, loaded and checked by the registry.
+        """
+        from django_cron.registry import get_registry
+        return get_registry().lock_class
 
     @property
     def msg(self):
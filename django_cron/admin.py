@@ -4,7 +4,7 @@ from django.contrib import admin
 from django.db.models import F
 from django.utils.translation import ugettext_lazy as _
 
-from django_cron.models import CronJobLog
+from django_cron.models import CronJobLog, CronJobState
 from django_cron.helpers import humanize_duration
 
 
@@ -37,8 +37,9 @@ class CronJobLogAdmin(admin.ModelAdmin):
 
     search_fields = ('code', 'message')
     ordering = ('-start_time',)
-    list_display = ('code', 'start_time', 'end_time', 'humanize_duration', 'is_success')
+    list_display = ('code', 'start_time', 'end_time', 'humanize_duration', 'is_success', 'do_duration', 'cpu_time', 'query_count')
     list_filter = ('code', 'start_time', 'is_success', DurationFilter)
+    readonly_fields = ('lock_duration', 'schedule_duration', 'do_duration', 'cpu_time', 'peak_rss', 'query_count')
 
     def get_readonly_fields(self, request, obj=None):
         if not request.user.is_superuser and obj is not None:
@@ -53,4 +54,20 @@ class CronJobLogAdmin(admin.ModelAdmin):
     humanize_duration.admin_order_field = 'duration'
 
 
+class CronJobStateAdmin(admin.ModelAdmin):
+    class Meta:
+        model = CronJobState
+
+    search_fields = ('code',)
+    ordering = ('code',)
+    list_display = ('code', 'last_start_time', 'last_run', 'last_success', 'last_failure', 'consecutive_failures')
+    list_filter = ('last_start_time',)
+    list_select_related = ('last_run', 'last_success', 'last_failure')
+    readonly_fields = [f.name for f in CronJobState._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
 admin.site.register(CronJobLog, CronJobLogAdmin)
+admin.site.register(CronJobState, CronJobStateAdmin)
@@ -0,0 +1,81 @@
+import threading
+
+from django_cron.timeout import CronJobTimeout
+
+try:
+    import asyncio
+except ImportError:
+    # Python 2, async jobs can't be written anyway
+    asyncio = None
+
+
+DEFAULT_ASYNC_CONCURRENCY = 10
+
+
+def is_async_job(cron_class):
+    """
+    Returns True if the do() method of the cron class is a coroutine function (`async def do(self)`).
+    """
+    return asyncio is not None and asyncio.iscoroutinefunction(getattr(cron_class, 'do', None))
+
+
+def is_coroutine(value):
+    return asyncio is not None and asyncio.iscoroutine(value)
+
+
+def run_coroutine(coroutine, timeout=None, event_loop=None):
+    """
+    Runs the coroutine returned by an async do() and returns its result,
+    cancelling it after `timeout` seconds (CronJobTimeout is raised).
+
+    The coroutine runs on the given EventLoopThread, shared with other
+    async jobs, otherwise on a new event loop in the current thread.
+    """
+    try:
+        if event_loop is not None:
+            return event_loop.run(coroutine, timeout)
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(asyncio.wait_for(coroutine, timeout))
+        finally:
+            loop.close()
+    except asyncio.TimeoutError:
+        raise CronJobTimeout('Timed out after %s seconds, the job was cancelled.' % timeout)
+
+
+class EventLoopThread(object):
+    """
+    An asyncio event loop running in a background thread, used as a context manager.
+
+    The async cron jobs of a runcrons run are started from worker threads,
+    which do all the database work (lock, should_run_now, make_log) and
+    submit the coroutine returned by do() with run(), so that all the
+    coroutines run concurrently on this single loop.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run_forever)
+        self.thread.daemon = True
+
+    def run_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coroutine, timeout=None):
+        """
+        Runs the coroutine on the loop and waits for its result,
+        from another thread.
+        """
+        future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(coroutine, timeout), self.loop)
+        return future.result()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
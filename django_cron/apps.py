@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class DjangoCronConfig(AppConfig):
+    name = 'django_cron'
+
+    def ready(self):
+        from django_cron.registry import get_registry
+
+        # Misconfigured CRON_CLASSES or DJANGO_CRON_LOCK_BACKEND fail at startup, not mid-run
+        get_registry()
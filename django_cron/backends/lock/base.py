@@ -1,3 +1,12 @@
+import logging
+import threading
+
+from django.conf import settings
+
+
+logger = logging.getLogger('django_cron')
+
+
 class DjangoCronJobLock(object):
     """
     The lock class to use in runcrons management command.
@@ -30,6 +39,42 @@ class DjangoCronJobLock(object):
         self.job_code = cron_class.code
         self.parallel = getattr(cron_class, 'ALLOW_PARALLEL_RUNS', False)
         self.silent = silent
+        self.batched = False
+        self.locked = False
+        self.entered = False
+
+    @classmethod
+    def lock_many(cls, cron_classes, silent):
+        """
+        Tries to acquire the locks of many cron classes at once, and returns
+        a lock instance per class, in the same order. Those whose `locked`
+        attribute is False are held by someone else: entering them raises
+        LockFailedException, like a failed lock().
+
+        Entering the returned locks doesn't lock again, and exiting them
+        releases them. Use release_many() for the locks that were not entered.
+
+        This implementation locks one class after another. Backends can
+        override it to take all the locks in a single round-trip, or return
+        locks that are not `batched`, taken when entered as usual.
+        """
+        locks = []
+        for cron_class in cron_classes:
+            lock = cls(cron_class, silent)
+            lock.batched = True
+            lock.locked = not lock.parallel and lock.lock()
+            locks.append(lock)
+        return locks
+
+    @classmethod
+    def release_many(cls, locks):
+        """
+        Releases the held locks among the given ones, returned by lock_many().
+        """
+        for lock in locks:
+            if lock.locked:
+                lock.release()
+                lock.locked = False
 
     def lock(self):
         """
@@ -49,16 +94,62 @@ class DjangoCronJobLock(object):
         """
         raise NotImplementedError('You have to implement release(self) method for your class')
 
+    def refresh(self):
+        """
+        This method is called every DJANGO_CRON_LOCK_REFRESH_INTERVAL seconds
+        while the job runs (from another thread), to extend locks that expire.
+        Return True if the lock is still held, False if it was lost.
+        Backends whose locks don't expire don't need to implement it.
+        """
+        return True
+
+    def lease(self, owner):
+        """
+        Takes or renews a lease named after the cron class for `owner`,
+        which expires after the lock timeout unless renewed by the same owner.
+        Return True if `owner` holds the lease.
+        Leases outlive the process, unlike locks: they are used to elect a
+        leader among the hosts running runcrons (see django_cron.leader).
+        """
+        raise NotImplementedError('%s does not support leases' % self.__class__.__name__)
+
+    def start_refreshing(self):
+        interval = getattr(settings, 'DJANGO_CRON_LOCK_REFRESH_INTERVAL', None)
+        if not interval:
+            return
+
+        self.refresh_stopped = threading.Event()
+
+        def refresh_periodically():
+            while not self.refresh_stopped.wait(interval):
+                if not self.refresh():
+                    logger.warning("%s: lock lost while the job is running.", self.job_name)
+                    return
+
+        thread = threading.Thread(target=refresh_periodically)
+        thread.daemon = True
+        thread.start()
+
+    def stop_refreshing(self):
+        if getattr(self, 'refresh_stopped', None) is not None:
+            self.refresh_stopped.set()
+
     def lock_failed_message(self):
         return "%s: lock found. Will try later." % self.job_name
 
     def __enter__(self):
+        self.entered = True
         if self.parallel:
             return
         else:
-            if not self.lock():
+            if not self.batched:
+                self.locked = self.lock()
+            if not self.locked:
                 raise self.LockFailedException(self.lock_failed_message())
+            self.start_refreshing()
 
     def __exit__(self, type, value, traceback):
         if not self.parallel:
+            self.stop_refreshing()
             self.release()
+            self.locked = False
@@ -1,6 +1,13 @@
 from django_cron.backends.lock.base import DjangoCronJobLock
 from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.memcached import PyLibMCCache
+from django.core.files import locks
 
+from contextlib import contextmanager
+import errno
+import os
+import uuid
 import warnings
 
 try:
@@ -20,28 +27,167 @@ class CacheLock(DjangoCronJobLock):
     """
     One of simplest lock backends, uses django cache to
     prevent parallel runs of commands.
+
+    The lock is taken with the atomic cache.add(), and stores a token
+    unique to this lock instance, so that only its owner releases it.
     """
     DEFAULT_LOCK_TIME = 24 * 60 * 60  # 24 hours
 
     def __init__(self, cron_class, *args, **kwargs):
         super(CacheLock, self).__init__(cron_class, *args, **kwargs)
 
-        self.cache = self.get_cache_by_name()
+        self.cache = kwargs.get('cache') or self.get_cache_by_name()
         self.lock_name = self.get_lock_name()
         self.timeout = self.get_cache_timeout(cron_class)
+        self.token = uuid.uuid4().hex
+        self.started = None
 
     def lock(self):
         """
         This method sets a cache variable to mark current job as "already running".
         """
-        if self.cache.get(self.lock_name):
-            return False
-        else:
-            self.cache.set(self.lock_name, timezone.now(), self.timeout)
-            return True
+        self.started = timezone.now()
+        with self.atomic(self.cache):
+            return self.cache.add(self.lock_name, (self.token, self.started), self.timeout)
+
+    @classmethod
+    def lock_many(cls, cron_classes, silent):
+        """
+        Adds the cache variables of all the cron classes at once: in a single
+        add_multi() call on pylibmc, under a single file lock on FileBasedCache.
+        """
+        if not cron_classes:
+            return []
+        cache = cls.get_cache_by_name()
+        locks = [cls(cron_class, silent, cache=cache) for cron_class in cron_classes]
+        for lock in locks:
+            lock.batched = True
+            lock.started = timezone.now()
+
+        values = dict((lock.lock_name, (lock.token, lock.started)) for lock in locks if not lock.parallel)
+        timeouts = set(lock.timeout for lock in locks)
+        with cls.atomic(cache):
+            if isinstance(cache, PyLibMCCache) and len(timeouts) == 1:
+                keys = dict((cache.make_key(name), name) for name in values)
+                failed = cache._cache.add_multi(
+                    dict((key, values[name]) for key, name in keys.items()),
+                    cache.get_backend_timeout(timeouts.pop())
+                )
+                added = set(keys.values()) - set(keys[key] for key in failed)
+            else:
+                added = set(lock.lock_name for lock in locks if lock.lock_name in values and cache.add(
+                    lock.lock_name, values[lock.lock_name], lock.timeout
+                ))
+
+        for lock in locks:
+            lock.locked = lock.lock_name in added
+        return locks
+
+    @classmethod
+    def release_many(cls, locks):
+        """
+        Deletes the cache variables of the given held locks, with one
+        get_many() to check their owner and one delete_many().
+        """
+        locks = [lock for lock in locks if lock.locked]
+        if not locks:
+            return
+        cache = locks[0].cache
+        with cls.atomic(cache):
+            values = cache.get_many([lock.lock_name for lock in locks])
+            cache.delete_many([
+                lock.lock_name for lock in locks
+                if isinstance(values.get(lock.lock_name), tuple) and values[lock.lock_name][0] == lock.token
+            ])
+        for lock in locks:
+            lock.locked = False
 
     def release(self):
-        self.cache.delete(self.lock_name)
+        """
+        Deletes the cache variable, unless the lock expired and was taken by
+        someone else meanwhile.
+        """
+        with self.atomic(self.cache):
+            if self.supports_cas(self.cache):
+                # memcached can't delete a key on a condition: first swap our
+                # value for one nobody owns, which the delete alone removes
+                if self.compare_and_set(self.cache, (None, None)):
+                    self.cache.delete(self.lock_name)
+            elif self.is_owner():
+                self.cache.delete(self.lock_name)
+
+    def refresh(self):
+        """
+        Restarts the lock timeout, so that jobs running longer than
+        DJANGO_CRON_LOCK_TIME keep their lock.
+        """
+        # Called from another thread, that needs its own cache connection
+        cache = self.get_cache_by_name()
+        with self.atomic(cache):
+            if self.supports_cas(cache):
+                return self.compare_and_set(cache, (self.token, self.started))
+            if not self.is_owner(cache):
+                return False
+            cache.set(self.lock_name, (self.token, self.started), self.timeout)
+            return True
+
+    def lease(self, owner):
+        with self.atomic(self.cache):
+            value = self.cache.get(self.lock_name)
+            if value is None:
+                return self.cache.add(self.lock_name, (owner, timezone.now()), self.timeout)
+            if isinstance(value, tuple) and value[0] == owner:
+                self.cache.set(self.lock_name, value, self.timeout)
+                return True
+            return False
+
+    @staticmethod
+    @contextmanager
+    def atomic(cache):
+        """
+        FileBasedCache.add() checks for the key then sets it, so concurrent
+        calls can all succeed. Serialize them with a lock file in the cache
+        directory; other caches are used as is.
+        """
+        if not isinstance(cache, FileBasedCache):
+            yield
+            return
+
+        try:
+            os.makedirs(cache._dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(os.path.join(cache._dir, 'django_cron.lock'), 'a') as f:
+            locks.lock(f, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(f)
+
+    @staticmethod
+    def supports_cas(cache):
+        """
+        pylibmc clients have gets() and cas() when the `cas` behavior is enabled
+        in the cache OPTIONS. Other caches check the owner with get() first,
+        which leaves a short race (see docs/locking_backend.rst).
+        """
+        return isinstance(cache, PyLibMCCache) and bool(cache._cache.behaviors.get('cas'))
+
+    def compare_and_set(self, cache, value):
+        """
+        Sets the cache variable to value if it still holds our token, unless
+        someone else changed it since it was read.
+        """
+        key = cache.make_key(self.lock_name)
+        current, cas_id = cache._cache.gets(key)
+        if not (isinstance(current, tuple) and current[0] == self.token):
+            return False
+        return bool(cache._cache.cas(key, value, cas_id, cache.get_backend_timeout(self.timeout)))
+
+    def is_owner(self, cache=None):
+        value = (cache or self.cache).get(self.lock_name)
+        return isinstance(value, tuple) and value[0] == self.token
 
     def lock_failed_message(self):
         started = self.get_running_lock_date()
@@ -55,7 +201,8 @@ class CacheLock(DjangoCronJobLock):
         ]
         return msgs
 
-    def get_cache_by_name(self):
+    @staticmethod
+    def get_cache_by_name():
         """
         Gets a specified cache (or the `default` cache if CRON_CACHE is not set)
         """
@@ -78,15 +225,15 @@ class CacheLock(DjangoCronJobLock):
         return self.job_name
 
     def get_cache_timeout(self, cron_class):
-        timeout = self.DEFAULT_LOCK_TIME
-        try:
-            timeout = getattr(cron_class, 'DJANGO_CRON_LOCK_TIME', settings.DJANGO_CRON_LOCK_TIME)
-        except:
-            pass
-        return timeout
+        return getattr(cron_class, 'DJANGO_CRON_LOCK_TIME', getattr(settings, 'DJANGO_CRON_LOCK_TIME', self.DEFAULT_LOCK_TIME))
 
     def get_running_lock_date(self):
         date = self.cache.get(self.lock_name)
+        if isinstance(date, tuple):
+            token, date = date
+        if date is None:
+            # The lock has been released meanwhile
+            return None
         if not timezone.is_aware(date):
             tz = timezone.get_current_timezone()
             date = timezone.make_aware(date, tz)
@@ -0,0 +1,166 @@
+from django_cron.backends.lock.base import DjangoCronJobLock
+from django_cron.models import CronJobLock
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import timezone
+
+from datetime import timedelta
+import hashlib
+import struct
+import uuid
+
+
+class DatabaseLock(DjangoCronJobLock):
+    """
+    Lock backend that uses the database, so that runcrons started on
+    several servers sharing a database don't run the same job twice.
+
+    On PostgreSQL and MySQL the lock is a session-level advisory lock
+    (pg_try_advisory_lock / GET_LOCK), held by the database connection of
+    the running job: it goes away with the connection if the process dies.
+
+    Other databases (SQLite, Oracle) use a row of the CronJobLock table,
+    created with a plain INSERT that fails when another process holds the lock.
+    That row expires after DJANGO_CRON_LOCK_TIME, like the cache lock.
+
+    In both cases taking and releasing the lock is a single statement.
+
+    Advisory locks belong to the connection of the thread that took them,
+    so lock_many() doesn't take them beforehand: each one is taken when
+    the job enters it, in the thread running the job.
+    """
+    DEFAULT_LOCK_TIME = 24 * 60 * 60  # 24 hours
+    ADVISORY_LOCK_VENDORS = ('postgresql', 'mysql')
+
+    def __init__(self, cron_class, *args, **kwargs):
+        super(DatabaseLock, self).__init__(cron_class, *args, **kwargs)
+
+        self.using = router.db_for_write(CronJobLock)
+        self.lock_name = self.get_lock_name()
+        self.timeout = self.get_lock_timeout(cron_class)
+        self.token = uuid.uuid4().hex
+        self.connection = None
+
+    @classmethod
+    def lock_many(cls, cron_classes, silent):
+        if connections[router.db_for_write(CronJobLock)].vendor in cls.ADVISORY_LOCK_VENDORS:
+            # Jobs run in other threads, whose connections must release the locks
+            return [cls(cron_class, silent) for cron_class in cron_classes]
+        return super(DatabaseLock, cls).lock_many(cron_classes, silent)
+
+    def lock(self):
+        connection = connections[self.using]
+        if connection.vendor in self.ADVISORY_LOCK_VENDORS:
+            # The lock belongs to this connection, keep it to release it
+            self.connection = connection
+            return self.advisory_lock(connection)
+
+        now = timezone.now()
+        try:
+            self.insert_lock(self.token, now)
+            return True
+        except IntegrityError:
+            # Take over the lock only if it expired
+            return bool(CronJobLock.objects.using(self.using).filter(job_name=self.lock_name, expires_at__lte=now).update(
+                token=self.token, locked_at=now, expires_at=now + timedelta(seconds=self.timeout)
+            ))
+
+    def insert_lock(self, token, now):
+        """
+        Inserts the lock row, raises IntegrityError if it exists.
+        """
+        def insert():
+            CronJobLock.objects.using(self.using).create(
+                job_name=self.lock_name, token=token, locked_at=now,
+                expires_at=now + timedelta(seconds=self.timeout)
+            )
+
+        if connections[self.using].in_atomic_block:
+            # A savepoint keeps the outer transaction usable after an IntegrityError
+            with transaction.atomic(using=self.using):
+                insert()
+        else:
+            insert()
+
+    def lease(self, owner):
+        """
+        Leases always use the CronJobLock table: advisory locks
+        don't outlive the connection.
+        """
+        token = hashlib.md5(owner.encode('utf-8')).hexdigest()
+        now = timezone.now()
+        rows = list(CronJobLock.objects.using(self.using).filter(job_name=self.lock_name).values_list('token', 'expires_at'))
+        if not rows:
+            try:
+                self.insert_lock(token, now)
+                return True
+            except IntegrityError:
+                return False
+
+        current_token, expires_at = rows[0]
+        if current_token != token and expires_at > now:
+            return False
+        values = {'token': token, 'expires_at': now + timedelta(seconds=self.timeout)}
+        if current_token != token:
+            values['locked_at'] = now
+        # Fails if another owner took over the lease meanwhile
+        return bool(CronJobLock.objects.using(self.using).filter(job_name=self.lock_name, token=current_token).update(**values))
+
+    def release(self):
+        if self.connection is not None:
+            self.advisory_unlock(self.connection)
+            self.connection = None
+            return
+        CronJobLock.objects.using(self.using).filter(job_name=self.lock_name, token=self.token).delete()
+
+    def refresh(self):
+        """
+        Advisory locks don't expire; lock table rows get a new expiry date.
+        """
+        if self.connection is not None:
+            return True
+        return bool(CronJobLock.objects.using(self.using).filter(job_name=self.lock_name, token=self.token).update(
+            expires_at=timezone.now() + timedelta(seconds=self.timeout)
+        ))
+
+    def advisory_lock(self, connection):
+        cursor = connection.cursor()
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [self.get_advisory_lock_key()])
+        else:
+            cursor.execute('SELECT GET_LOCK(%s, 0)', [self.get_advisory_lock_name()])
+        return bool(cursor.fetchone()[0])
+
+    def advisory_unlock(self, connection):
+        cursor = connection.cursor()
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [self.get_advisory_lock_key()])
+        else:
+            cursor.execute('SELECT RELEASE_LOCK(%s)', [self.get_advisory_lock_name()])
+
+    def get_advisory_lock_key(self):
+        """
+        PostgreSQL advisory locks are identified by a bigint
+        """
+        return struct.unpack('>q', hashlib.md5(self.get_advisory_lock_name().encode('utf-8')).digest()[:8])[0]
+
+    def get_advisory_lock_name(self):
+        # MySQL lock names are limited to 64 characters
+        return 'django_cron.%s' % hashlib.md5(self.lock_name.encode('utf-8')).hexdigest()
+
+    def lock_failed_message(self):
+        msgs = ["%s: lock has been found. Will try later." % self.job_name]
+        if self.connection is None:
+            locked_at = CronJobLock.objects.using(self.using).filter(job_name=self.lock_name).values_list('locked_at', flat=True)
+            for started in locked_at:
+                msgs.append("Other cron started at %s, current timeout for job %s is %s seconds." % (
+                    started, self.job_name, self.timeout
+                ))
+        return msgs
+
+    def get_lock_name(self):
+        return self.job_name
+
+    def get_lock_timeout(self, cron_class):
+        return getattr(cron_class, 'DJANGO_CRON_LOCK_TIME', getattr(settings, 'DJANGO_CRON_LOCK_TIME', self.DEFAULT_LOCK_TIME))
@@ -1,6 +1,7 @@
 from django.conf import settings
-from django_cron import CronJobBase, Schedule, get_class
-from django_cron.models import CronJobLog
+from django_cron import CronJobBase, Schedule
+from django_cron.models import CronJobLog, CronJobState
+from django_cron.registry import get_cron_class_attribute, load_cron_classes
 
 from django_common.helper import send_mail
 
@@ -16,7 +17,8 @@ class FailedRunsNotificationCronJob(CronJobBase):
 
     def do(self):
 
-        CRONS_TO_CHECK = map(lambda x: get_class(x), settings.CRON_CLASSES)
+        # Lazily declared classes are only imported if they don't declare MIN_NUM_FAILURES
+        CRONS_TO_CHECK = load_cron_classes()
         EMAILS = [admin[1] for admin in settings.ADMINS]
 
         try:
@@ -24,31 +26,37 @@ class FailedRunsNotificationCronJob(CronJobBase):
         except:
             FAILED_RUNS_CRONJOB_EMAIL_PREFIX = ''
 
-        for cron in CRONS_TO_CHECK:
-
-            try:
-                min_failures = cron.MIN_NUM_FAILURES
-            except AttributeError:
-                min_failures = 10
-
-            failures = 0
-
-            jobs = CronJobLog.objects.filter(code=cron.code).order_by('-end_time')[:min_failures]
+        # Failure streaks of all the crons in one query
+        codes = [cron.code for cron in CRONS_TO_CHECK]
+        consecutive_failures = dict(CronJobState.objects.filter(code__in=codes).values_list('code', 'consecutive_failures'))
+        for code in set(codes) - set(consecutive_failures):
+            consecutive_failures[code] = CronJobState.objects.rebuild(code).consecutive_failures
 
-            message = ''
-
-            for job in jobs:
-                if not job.is_success:
-                    failures += 1
-                    message += 'Job ran at %s : \n\n %s \n\n' % (job.start_time, job.message)
-
-            if failures == min_failures:
-                send_mail(
-                    '%s%s failed %s times in a row!' % (
-                        FAILED_RUNS_CRONJOB_EMAIL_PREFIX,
-                        cron.code,
-                        min_failures
-                    ),
-                    message,
-                    settings.DEFAULT_FROM_EMAIL, EMAILS
-                )
+        failed_crons = []
+        for cron in CRONS_TO_CHECK:
+            min_failures = get_cron_class_attribute(cron, 'MIN_NUM_FAILURES', 10)
+            if consecutive_failures[cron.code] >= min_failures:
+                failed_crons.append((cron, min_failures))
+
+        if not failed_crons:
+            return
+
+        # Log messages are only loaded for the crons that crossed their threshold
+        message = []
+        for cron, min_failures in failed_crons:
+            message.append('%s failed %s times in a row!\n\n' % (cron.code, min_failures))
+            jobs = CronJobLog.objects.filter(code=cron.code).order_by('-end_time').only('start_time', 'message')
+            for job in jobs[:min_failures]:
+                message.append('Job ran at %s : \n\n %s \n\n' % (job.start_time, job.message))
+
+        if len(failed_crons) == 1:
+            cron, min_failures = failed_crons[0]
+            subject = '%s%s failed %s times in a row!' % (FAILED_RUNS_CRONJOB_EMAIL_PREFIX, cron.code, min_failures)
+        else:
+            subject = '%s%s crons failed many times in a row: %s' % (
+                FAILED_RUNS_CRONJOB_EMAIL_PREFIX,
+                len(failed_crons),
+                ', '.join(cron.code for cron, min_failures in failed_crons)
+            )
+
+        send_mail(subject, ''.join(message), settings.DEFAULT_FROM_EMAIL, EMAILS)
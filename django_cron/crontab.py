@@ -0,0 +1,159 @@
+from datetime import timedelta
+
+
+MONTH_NAMES = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+DAY_NAMES = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+
+MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+# Enough to find the next Feb 29th, whatever the expression
+MAX_ITERATIONS = 5000
+
+
+def next_bit(mask, start):
+    """
+    Returns the lowest bit set in mask at position >= start, or None.
+    """
+    mask >>= start
+    if not mask:
+        return None
+    return start + (mask & -mask).bit_length() - 1
+
+
+class CronExpression(object):
+    """
+    A crontab-style expression: "minute hour day-of-month month day-of-week".
+
+    Fields accept `*`, values, `a-b` ranges, `/step` and comma-separated lists;
+    months and days of week also accept three letter names (jan, mon...), and
+    days of week go from 0 (Sunday) to 7 (Sunday again). The @yearly,
+    @monthly, @weekly, @daily and @hourly macros are supported too.
+
+    As in cron, when both day-of-month and day-of-week are restricted,
+    a day matches if either of them does.
+
+    Every field is compiled once into a bitset, so matching a datetime and
+    finding the next match of a field are constant time operations.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = MACROS.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ValueError("Invalid cron expression %r: expected 5 fields, got %s." % (expression, len(fields)))
+
+        minute, hour, day, month, weekday = fields
+        self.minutes = self.parse_field(minute, 0, 59)
+        self.hours = self.parse_field(hour, 0, 23)
+        self.days = self.parse_field(day, 1, 31)
+        self.months = self.parse_field(month, 1, 12, MONTH_NAMES, 1)
+        self.weekdays = self.parse_field(weekday, 0, 7, DAY_NAMES)
+        if self.weekdays & (1 << 7):
+            self.weekdays = (self.weekdays | 1) & ~(1 << 7)
+
+        self.days_restricted = not day.startswith('*')
+        self.weekdays_restricted = not weekday.startswith('*')
+
+    @classmethod
+    def from_time(cls, run_time):
+        """
+        Builds the expression matching a datetime.time every day.
+        """
+        return cls('%s %s * * *' % (run_time.minute, run_time.hour))
+
+    def __repr__(self):
+        return '<CronExpression %r>' % self.expression
+
+    def parse_field(self, field, minimum, maximum, names=None, names_offset=0):
+        mask = 0
+        for part in field.lower().split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/', 1)
+                step = self.parse_value(step, 1, maximum)
+
+            if part == '*':
+                start, end = minimum, maximum
+            elif '-' in part:
+                start, end = part.split('-', 1)
+                start = self.parse_value(start, minimum, maximum, names, names_offset)
+                end = self.parse_value(end, minimum, maximum, names, names_offset)
+                if start > end:
+                    raise ValueError("Invalid range %r in cron expression %r." % (part, self.expression))
+            else:
+                start = self.parse_value(part, minimum, maximum, names, names_offset)
+                end = maximum if step > 1 else start
+
+            for value in range(start, end + 1, step):
+                mask |= 1 << value
+        return mask
+
+    def parse_value(self, value, minimum, maximum, names=None, names_offset=0):
+        if names and value in names:
+            return names.index(value) + names_offset
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError("Invalid value %r in cron expression %r." % (value, self.expression))
+        if not minimum <= value <= maximum:
+            raise ValueError("Value %s out of range %s-%s in cron expression %r." % (value, minimum, maximum, self.expression))
+        return value
+
+    def matches_day(self, dt):
+        day = (self.days >> dt.day) & 1
+        weekday = (self.weekdays >> ((dt.weekday() + 1) % 7)) & 1
+        if self.days_restricted and self.weekdays_restricted:
+            return bool(day or weekday)
+        if self.days_restricted:
+            return bool(day)
+        if self.weekdays_restricted:
+            return bool(weekday)
+        return True
+
+    def matches(self, dt):
+        return bool(
+            (self.minutes >> dt.minute) & 1 and
+            (self.hours >> dt.hour) & 1 and
+            (self.months >> dt.month) & 1 and
+            self.matches_day(dt)
+        )
+
+    def get_next_run_time(self, after):
+        """
+        Returns the first matching minute strictly after the given datetime,
+        or None if the expression never matches (e.g. February 30th).
+        """
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+        for _ in range(MAX_ITERATIONS):
+            if not (self.months >> dt.month) & 1:
+                year, month = (dt.year + 1, 1) if dt.month == 12 else (dt.year, dt.month + 1)
+                dt = dt.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+
+            if not self.matches_day(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+
+            hour = next_bit(self.hours, dt.hour)
+            if hour is None:
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if hour != dt.hour:
+                dt = dt.replace(hour=hour, minute=0)
+
+            minute = next_bit(self.minutes, dt.minute)
+            if minute is None:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+                continue
+            return dt.replace(minute=minute)
+
+        return None
@@ -0,0 +1,150 @@
+from datetime import timedelta
+import logging
+import signal
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from django_cron.registry import get_registry
+from django_cron.run_state import CronJobRunState
+from django_cron.scheduler import CronJobScheduler
+
+
+logger = logging.getLogger('django_cron')
+
+
+class CronJobDaemon(object):
+    """
+    Keeps one process alive and runs the cron jobs as they become due,
+    instead of starting a new `runcrons` process every minute.
+
+    The job classes, the lock backend and the database connections are
+    reused from one tick to the next. Between ticks the daemon sleeps until
+    the next job is due (bounded by DJANGO_CRON_DAEMON_MIN_SLEEP and
+    DJANGO_CRON_DAEMON_MAX_SLEEP), and it stops after the current tick
+    on SIGTERM or SIGINT.
+
+    Next run times are kept in a NextRunTimeIndex, so a tick only loads and
+    evaluates the jobs whose next run time has passed. Runs made by other
+    processes can only be noticed when a job is re-evaluated, so the whole
+    index is rebuilt every DJANGO_CRON_DAEMON_REFRESH_INTERVAL seconds.
+    Jobs with DEPENDS_ON have no next run time until their upstream jobs
+    succeed: they are re-evaluated along with their upstream jobs.
+
+    With a LeaderLease, the ticks of the hosts that are not the leader only
+    check the lease.
+    """
+    DEFAULT_MIN_SLEEP = 1
+    DEFAULT_MAX_SLEEP = 60
+    DEFAULT_REFRESH_INTERVAL = 60 * 60
+
+    def __init__(self, cron_classes, run_crons, min_sleep=None, max_sleep=None, lease=None):
+        """
+        @cron_classes - cron classes to schedule
+        @run_crons    - callable running a list of due cron classes
+        @lease        - LeaderLease, when only the leader host runs the jobs
+        """
+        self.scheduler = CronJobScheduler(cron_classes)
+        self.positions = dict((cron_class, i) for i, cron_class in reversed(list(enumerate(cron_classes))))
+        self.run_crons = run_crons
+        self.min_sleep = min_sleep if min_sleep is not None else getattr(
+            settings, 'DJANGO_CRON_DAEMON_MIN_SLEEP', self.DEFAULT_MIN_SLEEP
+        )
+        self.max_sleep = max_sleep if max_sleep is not None else getattr(
+            settings, 'DJANGO_CRON_DAEMON_MAX_SLEEP', self.DEFAULT_MAX_SLEEP
+        )
+        self.refresh_interval = getattr(settings, 'DJANGO_CRON_DAEMON_REFRESH_INTERVAL', self.DEFAULT_REFRESH_INTERVAL)
+        self.lease = lease
+        if lease is not None:
+            # Renew the lease well before it expires
+            self.max_sleep = min(self.max_sleep, lease.ttl / 2.0)
+        self.index = None
+        self.refresh_at = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        self.install_signal_handlers()
+        logger.info("Cron daemon started with %s jobs", len(self.scheduler.cron_classes))
+
+        while not self.stopped.is_set():
+            try:
+                seconds = self.tick()
+            except Exception:
+                logger.exception("Cron daemon tick failed")
+                seconds = self.max_sleep
+            finally:
+                self.close_unusable_connections()
+            self.stopped.wait(seconds)
+
+        logger.info("Cron daemon stopped")
+
+    def tick(self):
+        """
+        Runs the due cron jobs and returns the number of seconds to sleep
+        before the next tick.
+        """
+        if self.lease is not None and not self.lease.is_leader():
+            # Runs made by the leader are only noticed by rebuilding the index
+            self.index = None
+            return self.max_sleep
+
+        now = timezone.now()
+        if self.index is None or now >= self.refresh_at:
+            self.index = self.scheduler.build_index()
+            self.refresh_at = now + timedelta(seconds=self.refresh_interval)
+
+        candidates = self.index.pop_due(now)
+        if candidates:
+            # Run the due jobs in the order of CRON_CLASSES, like runcrons does
+            candidates.sort(key=self.positions.get)
+            try:
+                run_state = CronJobRunState.load(candidates)
+                due_cron_classes = CronJobScheduler(candidates).get_due_cron_classes(run_state=run_state)
+                if due_cron_classes:
+                    self.run_crons(due_cron_classes)
+                evaluated = candidates + [x for x in self.get_downstream(candidates) if x not in candidates]
+                self.index.push(evaluated, CronJobRunState.load(evaluated))
+            except Exception:
+                # Rebuild everything on the next tick, the candidates are no longer indexed
+                self.index = None
+                raise
+
+        next_run_time = self.index.get_next_run_time()
+        if next_run_time is None:
+            return self.max_sleep
+
+        seconds = (next_run_time - timezone.now()).total_seconds()
+        return min(max(seconds, self.min_sleep), self.max_sleep)
+
+    def get_downstream(self, cron_classes):
+        """
+        Returns the scheduled cron classes depending on the given ones.
+        """
+        graph = get_registry().graph
+        downstream = []
+        for cron_class in cron_classes:
+            for x in graph.get_downstream(cron_class):
+                if x in self.positions and x not in downstream:
+                    downstream.append(x)
+        return downstream
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                signal.signal(signum, self.stop)
+            except ValueError:
+                # Signal handlers can only be set from the main thread
+                pass
+
+    def close_unusable_connections(self):
+        """
+        Keeps the database connections open between ticks, unless they broke.
+        """
+        for connection in connections.all():
+            if connection.connection is not None and not connection.is_usable():
+                connection.close()
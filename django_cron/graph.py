@@ -0,0 +1,113 @@
+from django.core.exceptions import ImproperlyConfigured
+
+from django_cron.log_buffer import flush_log_buffer
+from django_cron.pool import CronJobPool
+
+
+def get_upstream_codes(cron_class):
+    return list(getattr(cron_class, 'DEPENDS_ON', None) or ())
+
+
+class CronJobGraph(object):
+    """
+    The DEPENDS_ON relations between cron classes, checked when created:
+    every upstream code must belong to one of the classes, and there must
+    be no cycle. ImproperlyConfigured is raised otherwise.
+    """
+
+    def __init__(self, cron_classes):
+        self.cron_classes = list(cron_classes)
+        codes = set(cron_class.code for cron_class in self.cron_classes)
+        self.downstream = {}
+        for cron_class in self.cron_classes:
+            for code in get_upstream_codes(cron_class):
+                if code not in codes:
+                    raise ImproperlyConfigured('%s depends on %s, which is not in CRON_CLASSES' % (cron_class.code, code))
+                self.downstream.setdefault(code, []).append(cron_class)
+        self.sort(self.cron_classes)
+
+    def __bool__(self):
+        return bool(self.downstream)
+    __nonzero__ = __bool__
+
+    def get_downstream(self, cron_class):
+        """
+        Returns the cron classes that depend on the given one, in their original order.
+        """
+        return list(self.downstream.get(cron_class.code, ()))
+
+    def has_dependencies(self, cron_class):
+        return bool(get_upstream_codes(cron_class)) or cron_class.code in self.downstream
+
+    @staticmethod
+    def sort(cron_classes):
+        """
+        Returns the cron classes sorted so that every class comes after
+        those it depends on, otherwise keeping their order.
+        """
+        by_code = dict((cron_class.code, cron_class) for cron_class in cron_classes)
+        sorted_classes = []
+        done = set()
+        visiting = []
+
+        def visit(cron_class):
+            if cron_class.code in done:
+                return
+            if cron_class.code in visiting:
+                cycle = visiting[visiting.index(cron_class.code):] + [cron_class.code]
+                raise ImproperlyConfigured('DEPENDS_ON cycle: %s' % ' -> '.join(cycle))
+            visiting.append(cron_class.code)
+            for code in get_upstream_codes(cron_class):
+                if code in by_code:
+                    visit(by_code[code])
+            visiting.pop()
+            done.add(cron_class.code)
+            sorted_classes.append(cron_class)
+
+        for cron_class in cron_classes:
+            visit(cron_class)
+        return sorted_classes
+
+
+class CronJobGraphPool(CronJobPool):
+    """
+    Runs cron jobs in the order of their dependencies, in a pool of worker
+    threads: a job waits for its upstream jobs of the same run, and once a
+    job is done, the jobs that depend on it are started too, unless they
+    already ran. Jobs on independent branches run in parallel.
+
+    Whether a downstream job runs is decided by CronJobManager.run, as for
+    any job: it only does if its upstream jobs succeeded (see
+    CronJobManager.upstream_jobs_succeeded), and it's never forced.
+    """
+
+    def __init__(self, graph, workers, timeout=None):
+        super(CronJobGraphPool, self).__init__(workers, timeout)
+        self.graph = graph
+        self.triggered = set()
+
+    def run(self, target, cron_classes, **kwargs):
+        self.started = set()
+        return super(CronJobGraphPool, self).run(target, self.graph.sort(cron_classes), **kwargs)
+
+    def is_ready(self, cron_class, pending, running):
+        waiting = set(x.code for x in pending) | set(x.code for x in running)
+        return not waiting.intersection(get_upstream_codes(cron_class))
+
+    def start_job(self, target, cron_class, **kwargs):
+        self.started.add(cron_class.code)
+        if cron_class.code in self.triggered:
+            kwargs = dict(kwargs, force=False)
+        return super(CronJobGraphPool, self).start_job(target, cron_class, **kwargs)
+
+    def job_done(self, cron_class, pending):
+        downstream = [x for x in self.graph.get_downstream(cron_class) if x.code not in self.started]
+        if downstream:
+            # The downstream jobs check the success of this one in the database
+            flush_log_buffer()
+        new = []
+        for x in downstream:
+            if x.code not in set(y.code for y in pending):
+                self.triggered.add(x.code)
+                new.append(x)
+        return new
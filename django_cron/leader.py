@@ -0,0 +1,52 @@
+import socket
+
+from django.conf import settings
+
+from django_cron import CronJobManager
+
+
+class LeaderLease(object):
+    """
+    Elects a leader among the hosts running runcrons, so that only one of
+    them evaluates the schedules and tries the locks of the jobs.
+
+    The leader holds a lease taken with the lock backend (see
+    DjangoCronJobLock.lease), renewed on every runcrons run or daemon tick.
+    The other hosts only check the lease, and take it over once it expires,
+    `ttl` seconds after the leader's last renewal.
+
+    The job locks are still taken by the leader, so a host that believes to
+    be the leader for a little too long can't run a job twice.
+    """
+    code = 'django_cron.leader'
+
+    def __init__(self, ttl, owner=None, lock_class=None):
+        """
+        @ttl        - seconds after which the lease of a leader that stopped renewing it expires
+        @owner      - name of this host, defaults to DJANGO_CRON_NODE_NAME or the host name
+        @lock_class - lock backend, defaults to DJANGO_CRON_LOCK_BACKEND
+        """
+        self.ttl = ttl
+        self.owner = owner or getattr(settings, 'DJANGO_CRON_NODE_NAME', None) or socket.gethostname()
+        lock_class = lock_class or CronJobManager.get_lock_class()
+
+        # Lock backends expect a cron class, this one stands for the lease
+        lease_class = type('DjangoCronLeader', (object,), {'code': self.code, 'DJANGO_CRON_LOCK_TIME': ttl})
+        self.lock = lock_class(lease_class, True)
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Returns the lease set up by DJANGO_CRON_LEADER_LEASE_TTL,
+        or None when leader election is disabled (default).
+        """
+        ttl = getattr(settings, 'DJANGO_CRON_LEADER_LEASE_TTL', None)
+        if not ttl:
+            return None
+        return cls(ttl)
+
+    def is_leader(self):
+        """
+        Takes or renews the lease, returns True if this host holds it.
+        """
+        return self.lock.lease(self.owner)
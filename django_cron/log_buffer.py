@@ -0,0 +1,115 @@
+from datetime import timedelta
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from django_cron.models import CronJobLog, CronJobState
+from django_cron.run_state import CronJobRunState
+
+
+logger = logging.getLogger('django_cron')
+
+log_buffer = None
+log_buffer_mutex = threading.Lock()
+
+
+def get_log_buffer():
+    """
+    Returns the process-wide CronJobLogBuffer when DJANGO_CRON_LOG_BUFFER_INTERVAL
+    is set, None otherwise (default: every log is saved right away).
+    """
+    global log_buffer
+
+    interval = getattr(settings, 'DJANGO_CRON_LOG_BUFFER_INTERVAL', None)
+    if interval is None:
+        return None
+    with log_buffer_mutex:
+        if log_buffer is None:
+            log_buffer = CronJobLogBuffer()
+            atexit.register(log_buffer.flush)
+        log_buffer.interval = interval
+    return log_buffer
+
+
+def flush_log_buffer():
+    if log_buffer is not None:
+        log_buffer.flush()
+
+
+class CronJobLogBuffer(object):
+    """
+    Collects the CronJobLog rows of successful runs and saves them with
+    one bulk_create, in a single transaction with the CronJobState updates.
+
+    runcrons flushes the buffer when it's done with the due jobs (so once
+    per run or daemon tick), and it is flushed when a log is added
+    `interval` seconds after the oldest buffered one, and at exit.
+    Failures are not buffered, CronJobManager.make_log saves them right away.
+    """
+
+    def __init__(self, interval=0):
+        self.interval = interval
+        self.logs = []
+        self.buffered_at = None
+        self.mutex = threading.Lock()
+
+    def add(self, cron_log):
+        with self.mutex:
+            if not self.logs:
+                self.buffered_at = time.time()
+            self.logs.append(cron_log)
+            expired = time.time() - self.buffered_at >= self.interval
+        if expired:
+            self.flush()
+
+    def flush(self):
+        with self.mutex:
+            cron_logs, self.logs = self.logs, []
+            if not cron_logs:
+                return
+            try:
+                self.write(cron_logs)
+            except Exception:
+                logger.exception("Error saving %s buffered cronjob logs", len(cron_logs))
+                return
+
+        for cron_log in cron_logs:
+            CronJobRunState.record(cron_log)
+
+    def write(self, cron_logs):
+        with transaction.atomic():
+            CronJobLog.objects.bulk_create(cron_logs)
+            self.set_pks(cron_logs)
+            saved = [cron_log for cron_log in cron_logs if cron_log.pk is not None]
+            for code in set(cron_log.code for cron_log in cron_logs if cron_log.pk is None):
+                # Not found again, the state is rebuilt from the log table
+                CronJobState.objects.filter(code=code).delete()
+                CronJobState.objects.rebuild(code)
+            CronJobState.objects.record_many(saved)
+
+    def set_pks(self, cron_logs):
+        """
+        bulk_create doesn't set the primary keys, that CronJobState needs:
+        read them back in one query, by code and start time.
+        """
+        if all(cron_log.pk is not None for cron_log in cron_logs):
+            return
+
+        rows = CronJobLog.objects.filter(
+            code__in=set(cron_log.code for cron_log in cron_logs),
+            start_time__gte=min(cron_log.start_time for cron_log in cron_logs) - timedelta(seconds=1)
+        ).values_list('pk', 'code', 'start_time')
+        pks = {}
+        for pk, code, start_time in rows:
+            pks[(code, start_time)] = pk
+            # Databases storing no microseconds (MySQL < 5.6)
+            pks.setdefault((code, start_time.replace(microsecond=0)), pk)
+
+        for cron_log in cron_logs:
+            cron_log.pk = pks.get((cron_log.code, cron_log.start_time))
+            if cron_log.pk is None:
+                cron_log.pk = pks.get((cron_log.code, cron_log.start_time.replace(microsecond=0)))
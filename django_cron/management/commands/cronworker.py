@@ -0,0 +1,94 @@
+from optparse import make_option
+import logging
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from django_cron import metrics
+from django_cron.management.commands import runcrons
+from django_cron.queue import get_queue
+from django_cron.registry import get_cron_class
+try:
+    from django.db import close_old_connections as close_connection
+except ImportError:
+    from django.db import close_connection
+
+
+DEFAULT_POLL_INTERVAL = 5
+
+logger = logging.getLogger('django_cron')
+
+
+class Command(runcrons.Command):
+    """
+    Claims the cron jobs enqueued by runcrons (with DJANGO_CRON_QUEUE set)
+    and runs them, up to --workers at once. Any number of cronworker
+    processes can share the queue, on any number of hosts.
+
+    Jobs run as with runcrons: under their lock, after checking they are
+    still due (unless enqueued by runcrons --force), and logged in CronJobLog.
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--silent', action='store_true', help='Do not push any message on console'),
+        make_option('--workers', type='int', help='Number of cron jobs to run in parallel'),
+        make_option('--timeout', type='int', help='Seconds to wait for each cron job when running in parallel'),
+        make_option('--poll-interval', type='float', dest='poll_interval', help='Seconds to wait when the queue is empty'),
+        make_option('--once', action='store_true', help='Exit once the queue is empty'),
+    )
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        if queue is None:
+            self.stdout.write('Set DJANGO_CRON_QUEUE to use cronworker.\n')
+            return
+
+        workers = options.get('workers') or getattr(settings, 'DJANGO_CRON_WORKERS', 1)
+        poll_interval = options.get('poll_interval') or getattr(settings, 'DJANGO_CRON_QUEUE_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+
+        self.stopped = threading.Event()
+        self.install_signal_handlers()
+        while not self.stopped.is_set():
+            jobs = queue.claim(workers)
+            if not jobs:
+                if options.get('once'):
+                    break
+                close_connection()
+                self.stopped.wait(poll_interval)
+                continue
+
+            try:
+                self.run_jobs(jobs, workers, options.get('silent'), options.get('timeout'))
+            finally:
+                queue.done(jobs)
+        close_connection()
+
+    def run_jobs(self, jobs, workers, silent=False, timeout=None):
+        now = timezone.now()
+        for job in jobs:
+            lag = (now - job.enqueued_at).total_seconds()
+            metrics.observe('django_cron.queue_lag', lag, code=job.code)
+            logger.debug("Claimed cron %s, %.1f seconds after it was enqueued", job.code, lag)
+
+        cron_classes = {False: [], True: []}
+        for job in jobs:
+            try:
+                cron_classes[job.force].append(get_cron_class(job.cron_class))
+            except Exception:
+                # e.g. a class removed by a deploy since it was enqueued
+                logger.exception("Cannot load %s, dropping the queued cron %s", job.cron_class, job.code)
+
+        for force in (False, True):
+            if cron_classes[force]:
+                self.run_crons(cron_classes[force], force=force, silent=silent, workers=workers, timeout=timeout)
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                # Finish the claimed jobs, then stop
+                signal.signal(signum, lambda *args: self.stopped.set())
+            except ValueError:
+                # Signal handlers can only be set from the main thread
+                pass
@@ -0,0 +1,126 @@
+from datetime import timedelta
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import router
+from django.db.models import Max
+from django.db.models.sql import DeleteQuery
+from django.utils import timezone
+
+from django_cron.registry import get_cron_class_attribute, load_cron_classes
+from django_cron.models import CronJobLog, CronJobState
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """
+    Deletes old CronJobLog rows.
+
+    Retention is set per job with the LOG_RETENTION_DAYS and LOG_RETENTION_RUNS
+    attributes of its cron class, falling back to the DJANGO_CRON_LOG_RETENTION_DAYS
+    and DJANGO_CRON_LOG_RETENTION_RUNS settings (or the --days and --runs options).
+    A row is deleted when it is older than the days limit or beyond the runs limit.
+
+    Rows are deleted in batches of --batch-size rows, taken in primary key order
+    from the rows of the job (not scanning the rows of other jobs), with short
+    statements that don't load the rows, so the table is never locked for long.
+    The rows runcrons needs to schedule jobs (latest success, latest failure and
+    today's run_at_times runs) are always kept, and so are those CronJobState
+    refers to.
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--days', type='int', help='Keep logs of the last X days of jobs without LOG_RETENTION_DAYS'),
+        make_option('--runs', type='int', help='Keep the last X logs of jobs without LOG_RETENTION_RUNS'),
+        make_option('--batch-size', type='int', dest='batch_size', help='Number of primary keys deleted at once'),
+    )
+
+    def handle(self, *args, **options):
+        self.default_days = options.get('days') or getattr(settings, 'DJANGO_CRON_LOG_RETENTION_DAYS', None)
+        self.default_runs = options.get('runs') or getattr(settings, 'DJANGO_CRON_LOG_RETENTION_RUNS', None)
+        self.batch_size = options.get('batch_size') or getattr(settings, 'DJANGO_CRON_LOG_RETENTION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+        cron_classes = dict((x.code, x) for x in load_cron_classes())
+        now = timezone.now()
+
+        started = time.time()
+        total = 0
+        for code in CronJobLog.objects.values_list('code', flat=True).distinct().order_by('code'):
+            cutoff = self.get_cutoff(code, cron_classes.get(code), now)
+            if cutoff is None:
+                continue
+
+            deleted = self.prune(code, cutoff, now)
+            if deleted:
+                self.stdout.write('%s: deleted %s logs older than %s\n' % (code, deleted, cutoff))
+            total += deleted
+
+        duration = time.time() - started
+        self.stdout.write('Deleted %s logs in %.1f seconds (%.0f rows/s)\n' % (
+            total, duration, total / duration if duration else 0
+        ))
+
+    def get_cutoff(self, code, cron_class, now):
+        """
+        Returns the start time before which logs of this job can be deleted,
+        or None if all of them are kept.
+        """
+        days = get_cron_class_attribute(cron_class, 'LOG_RETENTION_DAYS', self.default_days)
+        runs = get_cron_class_attribute(cron_class, 'LOG_RETENTION_RUNS', self.default_runs)
+
+        cutoffs = []
+        if days is not None:
+            cutoffs.append(now - timedelta(days=days))
+        if runs is not None:
+            start_times = CronJobLog.objects.filter(code=code).order_by('-start_time').values_list('start_time', flat=True)
+            nth = list(start_times[runs - 1:runs]) if runs > 0 else [now]
+            if nth:
+                cutoffs.append(nth[0])
+        return max(cutoffs) if cutoffs else None
+
+    def get_protected_pks(self, code, now):
+        """
+        Returns the primary keys of the logs should_run_now reads for this job.
+        """
+        queryset = CronJobLog.objects.filter(code=code)
+        start_times = []
+        for latest in (
+            queryset.filter(is_success=True),
+            queryset.filter(is_success=False),
+            queryset.filter(is_success=True, ran_at_time__isnull=True),
+        ):
+            start_time = latest.aggregate(start_time=Max('start_time'))['start_time']
+            if start_time is not None:
+                start_times.append(start_time)
+
+        pks = set(queryset.filter(start_time__in=start_times).values_list('pk', flat=True))
+        pks.update(queryset.filter(
+            is_success=True,
+            ran_at_time__isnull=False,
+            end_time__gte=now.replace(hour=0, minute=0, second=0, microsecond=0)
+        ).values_list('pk', flat=True))
+        # Kept so that its foreign keys don't have to be set to NULL
+        for state in CronJobState.objects.filter(code=code).values_list('last_run', 'last_success', 'last_failure'):
+            pks.update(pk for pk in state if pk is not None)
+        return pks
+
+    def prune(self, code, cutoff, now):
+        queryset = CronJobLog.objects.filter(code=code, start_time__lt=cutoff).order_by('pk')
+        protected = self.get_protected_pks(code, now)
+        using = router.db_for_write(CronJobLog)
+        deleted = 0
+        last_pk = None
+        while True:
+            batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            pks = list(batch.values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                return deleted
+            last_pk = pks[-1]
+            pks = [pk for pk in pks if pk not in protected]
+            if pks:
+                # Unlike QuerySet.delete(), doesn't fetch the rows to handle the foreign keys of CronJobState
+                DeleteQuery(CronJobLog).delete_batch(pks, using)
+                deleted += len(pks)
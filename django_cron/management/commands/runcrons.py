@@ -1,9 +1,23 @@
 from optparse import make_option
+import importlib
+import logging
+import sys
+import threading
+import time
 import traceback
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from django_cron import CronJobManager, get_class
+from django_cron import CronJobManager, metrics
+from django_cron.aio import DEFAULT_ASYNC_CONCURRENCY, EventLoopThread, is_async_job
+from django_cron.daemon import CronJobDaemon
+from django_cron.leader import LeaderLease
+from django_cron.log_buffer import flush_log_buffer
+from django_cron.pool import CronJobPool
+from django_cron.queue import get_queue
+from django_cron.graph import CronJobGraphPool
+from django_cron.registry import get_cron_class, get_module_name, get_registry, load_cron_classes, resolve_cron_class
+from django_cron.scheduler import CronJobScheduler
 try:
     from django.db import close_old_connections as close_connection
 except ImportError:
@@ -12,11 +26,17 @@ except ImportError:
 
 DEFAULT_LOCK_TIME = 24 * 60 * 60  # 24 hours
 
+logger = logging.getLogger('django_cron')
+
 
 class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
         make_option('--force', action='store_true', help='Force cron runs'),
         make_option('--silent', action='store_true', help='Do not push any message on console'),
+        make_option('--workers', type='int', help='Number of cron jobs to run in parallel'),
+        make_option('--timeout', type='int', help='Seconds to wait for each cron job when running in parallel'),
+        make_option('--daemon', action='store_true', help='Keep running and start the cron jobs as they become due'),
+        make_option('--profile-startup', action='store_true', dest='profile_startup', help='Report the import time of the cron job modules, run nothing'),
     )
 
     def handle(self, *args, **options):
@@ -24,35 +44,176 @@ class Command(BaseCommand):
         Iterates over all the CRON_CLASSES (or if passed in as a commandline argument)
         and runs them.
         """
-        if args:
-            cron_class_names = args
-        else:
-            cron_class_names = getattr(settings, 'CRON_CLASSES', [])
+        if options.get('profile_startup'):
+            self.profile_startup(args or getattr(settings, 'CRON_CLASSES', []))
+            return
 
         try:
-            crons_to_run = [get_class(x) for x in cron_class_names]
+            if args:
+                crons_to_run = [get_cron_class(x) for x in args]
+            else:
+                # Classes declared with their code and schedule are imported when due
+                cron_class_names = getattr(settings, 'CRON_CLASSES', [])
+                crons_to_run = load_cron_classes()
         except:
             error = traceback.format_exc()
-            self.stdout.write('Make sure these are valid cron class names: %s\n%s' % (cron_class_names, error))
+            self.stdout.write('Make sure these are valid cron class names: %s\n%s' % (args or cron_class_names, error))
             return
 
-        for cron_class in crons_to_run:
-            run_cron_with_cache_check(
-                cron_class,
-                force=options['force'],
-                silent=options['silent']
-            )
+        # Forced runs are started by hand on a given host
+        lease = None if options['force'] else LeaderLease.from_settings()
+
+        if options.get('daemon'):
+            # --force would make every job run on every tick
+            run_options = dict(options, force=False)
+            daemon = CronJobDaemon(crons_to_run, lambda due_crons: self.dispatch_crons(due_crons, **run_options), lease=lease)
+            daemon.run()
+        elif lease is not None and not lease.is_leader():
+            if not options['silent']:
+                logger.info("%s is not the leader, the cron jobs run on another host.", lease.owner)
+        else:
+            crons_to_run = CronJobScheduler(crons_to_run).get_due_cron_classes(force=options['force'])
+            self.dispatch_crons(crons_to_run, **options)
         close_connection()
 
+    def dispatch_crons(self, crons_to_run, force=False, silent=False, **options):
+        """
+        Runs the due cron classes, or enqueues them for cronworker
+        when DJANGO_CRON_QUEUE is set.
+        """
+        queue = get_queue()
+        if queue is None:
+            self.run_crons(crons_to_run, force=force, silent=silent, **options)
+            return
+
+        count = queue.put([x for x in crons_to_run if CronJobScheduler.is_cron_job(x)], force)
+        metrics.increment('django_cron.enqueued', count)
+        if not silent:
+            logger.info("Enqueued %s of %s due cron jobs.", count, len(crons_to_run))
+
+    def run_crons(self, crons_to_run, force=False, silent=False, workers=None, timeout=None, **options):
+        """
+        Runs the given cron classes, one after another or in parallel threads.
+
+        When some of them have DEPENDS_ON relations, they run in the order of
+        their dependencies, and the jobs depending on them are started as
+        soon as they succeed (see CronJobGraphPool).
+
+        With DJANGO_CRON_BATCH_LOCKS, the locks of all the cron classes are
+        acquired at once beforehand, and each one is released when its job is done.
+        """
+        crons_to_run = [self.resolve_cron_class(x) for x in crons_to_run]
+
+        locks = {}
+        if getattr(settings, 'DJANGO_CRON_BATCH_LOCKS', False) and crons_to_run:
+            lock_class = CronJobManager.get_lock_class()
+            cron_jobs = [x for x in crons_to_run if CronJobScheduler.is_cron_job(x)]
+            locks = dict(zip(cron_jobs, lock_class.lock_many(cron_jobs, silent)))
+
+        def run_cron(cron_class, **kwargs):
+            run_cron_with_cache_check(cron_class, lock=locks.get(cron_class), **kwargs)
+
+        graph = get_registry().graph
+        with_dependencies = any(graph.has_dependencies(x) for x in crons_to_run if CronJobScheduler.is_cron_job(x))
+
+        # Async jobs run on their own event loop, alongside the others
+        async_crons = [x for x in crons_to_run if is_async_job(x) and not graph.has_dependencies(x)]
+        crons_to_run = [x for x in crons_to_run if x not in async_crons]
+
+        try:
+            async_thread = None
+            if async_crons:
+                async_thread = threading.Thread(target=self.run_async_crons, args=(async_crons, run_cron, force, silent))
+                async_thread.daemon = True
+                async_thread.start()
+
+            workers = workers or getattr(settings, 'DJANGO_CRON_WORKERS', 1)
+            timeout = timeout or getattr(settings, 'DJANGO_CRON_WORKER_TIMEOUT', None)
+            if with_dependencies:
+                pool = CronJobGraphPool(graph, workers, timeout)
+                pool.run(run_cron, crons_to_run, force=force, silent=silent)
+            elif workers > 1:
+                pool = CronJobPool(workers, timeout)
+                pool.run(run_cron, crons_to_run, force=force, silent=silent)
+            else:
+                for cron_class in crons_to_run:
+                    run_cron(cron_class, force=force, silent=silent)
+
+            if async_thread is not None:
+                async_thread.join()
+        finally:
+            if locks:
+                # Jobs that didn't start, e.g. when interrupted
+                lock_class.release_many([lock for lock in locks.values() if not lock.entered])
+            flush_log_buffer()
+
+    @staticmethod
+    def resolve_cron_class(cron_class):
+        try:
+            return resolve_cron_class(cron_class)
+        except Exception:
+            # CronJobManager.run tries again and logs the error as a failed run
+            return cron_class
+
+    def profile_startup(self, entries):
+        """
+        Imports the modules of the given cron classes one by one, and reports
+        how long each import took, slowest first. Modules imported by an
+        earlier one are reported as already imported.
+
+        The modules of the cron classes given by path are imported when
+        Django starts, by the registry, whose import times are reported.
+        """
+        import_times = get_registry().import_times
+        timings = []
+        for module_name in sorted(set(get_module_name(entry) for entry in entries)):
+            if module_name in import_times:
+                duration, modules_count = import_times[module_name]
+                timings.append((duration, module_name, modules_count))
+                continue
+            if module_name in sys.modules:
+                timings.append((None, module_name, 0))
+                continue
+            modules_count = len(sys.modules)
+            started = time.time()
+            try:
+                importlib.import_module(module_name)
+            except Exception as e:
+                self.stdout.write('%s: import failed: %s\n' % (module_name, e))
+                continue
+            timings.append((time.time() - started, module_name, len(sys.modules) - modules_count))
+
+        timings.sort(key=lambda x: -1 if x[0] is None else x[0], reverse=True)
+        for duration, module_name, modules_count in timings:
+            if duration is None:
+                self.stdout.write('%10s  %s (already imported)\n' % ('-', module_name))
+            else:
+                self.stdout.write('%9.3fs  %s (%s modules)\n' % (duration, module_name, modules_count))
+        self.stdout.write('%9.3fs  total\n' % sum(x[0] or 0 for x in timings))
+
+    def run_async_crons(self, cron_classes, run_cron, force=False, silent=False):
+        """
+        Runs the cron classes whose do() is a coroutine function, concurrently
+        on one event loop, at most DJANGO_CRON_ASYNC_CONCURRENCY at once.
+
+        Each job gets a worker thread for its database work (lock,
+        should_run_now, make_log), only the do() coroutines run on the loop.
+        """
+        concurrency = getattr(settings, 'DJANGO_CRON_ASYNC_CONCURRENCY', DEFAULT_ASYNC_CONCURRENCY)
+        with EventLoopThread() as event_loop:
+            CronJobPool(concurrency).run(run_cron, cron_classes, force=force, silent=silent, event_loop=event_loop)
+
 
-def run_cron_with_cache_check(cron_class, force=False, silent=False):
+def run_cron_with_cache_check(cron_class, force=False, silent=False, lock=None, event_loop=None):
     """
     Checks the cache and runs the cron or not.
 
     @cron_class - cron class to run.
     @force      - run job even if not scheduled
     @silent     - suppress notifications
+    @lock       - lock of the job acquired beforehand, if any
+    @event_loop - EventLoopThread running the coroutine of async jobs, if any
     """
 
-    with CronJobManager(cron_class, silent) as manager:
+    with CronJobManager(cron_class, silent, lock=lock, event_loop=event_loop) as manager:
         manager.run(force)
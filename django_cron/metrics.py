@@ -0,0 +1,124 @@
+from collections import defaultdict
+import logging
+import threading
+
+from django.conf import settings
+
+
+DEFAULT_METRICS_BACKEND = 'django_cron.metrics.NullMetrics'
+
+logger = logging.getLogger('django_cron')
+
+metrics_backends = {}
+metrics_backends_mutex = threading.Lock()
+
+
+def get_metrics():
+    """
+    Returns the metrics backend set by DJANGO_CRON_METRICS_BACKEND,
+    created once per process.
+    """
+    from django_cron import get_class
+
+    path = getattr(settings, 'DJANGO_CRON_METRICS_BACKEND', None) or DEFAULT_METRICS_BACKEND
+    with metrics_backends_mutex:
+        if path not in metrics_backends:
+            metrics_backends[path] = get_class(path)()
+        return metrics_backends[path]
+
+
+def increment(name, value=1, **tags):
+    """
+    Increments a counter, never raising: metrics must not make a job fail.
+    """
+    try:
+        get_metrics().increment(name, value, tags)
+    except Exception:
+        logger.exception("Error sending metric %s", name)
+
+
+def observe(name, value, **tags):
+    """
+    Records a value (a number of seconds) in a histogram, never raising.
+    """
+    try:
+        get_metrics().observe(name, value, tags)
+    except Exception:
+        logger.exception("Error sending metric %s", name)
+
+
+class BaseMetrics(object):
+    """
+    Receives the metrics of the scheduler, to forward them to StatsD,
+    Prometheus etc. Metrics are named 'django_cron.<metric>' and tagged
+    with the code of the job when there is one:
+
+    + runs (counter) - runs logged in CronJobLog
+    + failures (counter) - failed runs
+    + lock_contention (counter) - runs skipped because the job was locked
+    + job_duration (histogram) - seconds spent in do()
+    + schedule_evaluation (histogram) - seconds spent evaluating the schedules of the due jobs
+    + enqueued (counter) - jobs enqueued by runcrons, with DJANGO_CRON_QUEUE
+    + queue_lag (histogram) - seconds between enqueuing a job and a cronworker claiming it
+
+    Methods are called from the threads running the jobs.
+    """
+
+    def increment(self, name, value, tags):
+        raise NotImplementedError('You have to implement increment(self, name, value, tags) method for your class')
+
+    def observe(self, name, value, tags):
+        raise NotImplementedError('You have to implement observe(self, name, value, tags) method for your class')
+
+
+class NullMetrics(BaseMetrics):
+    """
+    Default backend, drops all the metrics.
+    """
+
+    def increment(self, name, value, tags):
+        pass
+
+    def observe(self, name, value, tags):
+        pass
+
+
+class InMemoryMetrics(BaseMetrics):
+    """
+    Keeps the metrics in memory, for tests.
+    """
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.mutex:
+            self.counters = defaultdict(int)
+            self.histograms = defaultdict(list)
+
+    def increment(self, name, value, tags):
+        with self.mutex:
+            self.counters[(name, frozenset(tags.items()))] += value
+
+    def observe(self, name, value, tags):
+        with self.mutex:
+            self.histograms[(name, frozenset(tags.items()))].append(value)
+
+    def get_counter(self, name, **tags):
+        """
+        Returns the sum of the counter for the metrics having (at least) the given tags.
+        """
+        with self.mutex:
+            return sum(value for key, value in self.counters.items() if self.matches(key, name, tags))
+
+    def get_observations(self, name, **tags):
+        """
+        Returns the values recorded for the metrics having (at least) the given tags.
+        """
+        with self.mutex:
+            return [x for key, values in self.histograms.items() if self.matches(key, name, tags) for x in values]
+
+    @staticmethod
+    def matches(key, name, tags):
+        return key[0] == name and set(tags.items()) <= key[1]
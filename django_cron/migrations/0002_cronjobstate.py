@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_cron', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CronJobState',
+            fields=[
+                ('code', models.CharField(primary_key=True, max_length=64, serialize=False)),
+                ('last_start_time', models.DateTimeField(blank=True, null=True)),
+                ('consecutive_failures', models.PositiveIntegerField(default=0)),
+                ('ran_at_date', models.DateField(blank=True, null=True)),
+                ('ran_at_times', models.CharField(max_length=255, blank=True, default='')),
+                ('last_failure', models.ForeignKey(
+                    blank=True, null=True, related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='django_cron.CronJobLog'
+                )),
+                ('last_run', models.ForeignKey(
+                    blank=True, null=True, related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='django_cron.CronJobLog'
+                )),
+                ('last_success', models.ForeignKey(
+                    blank=True, null=True, related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='django_cron.CronJobLog'
+                )),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_cron', '0002_cronjobstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CronJobLock',
+            fields=[
+                ('job_name', models.CharField(primary_key=True, max_length=200, serialize=False)),
+                ('token', models.CharField(max_length=32)),
+                ('locked_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_cron', '0003_cronjoblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CronJobQueueEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('code', models.CharField(max_length=64, db_index=True)),
+                ('cron_class', models.CharField(max_length=255)),
+                ('force', models.BooleanField(default=False)),
+                ('enqueued_at', models.DateTimeField()),
+                ('claimed_by', models.CharField(max_length=32, blank=True, db_index=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
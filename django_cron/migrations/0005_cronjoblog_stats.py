@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_cron', '0004_cronjobqueueentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cronjoblog',
+            name='cpu_time',
+            field=models.FloatField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cronjoblog',
+            name='do_duration',
+            field=models.FloatField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cronjoblog',
+            name='lock_duration',
+            field=models.FloatField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cronjoblog',
+            name='peak_rss',
+            field=models.PositiveIntegerField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cronjoblog',
+            name='query_count',
+            field=models.PositiveIntegerField(blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cronjoblog',
+            name='schedule_duration',
+            field=models.FloatField(blank=True, null=True, editable=False),
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from datetime import time as datetime_time, timedelta
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import Max
 
 
 class CronJobLog(models.Model):
@@ -17,6 +20,17 @@ class CronJobLog(models.Model):
     """
     ran_at_time = models.TimeField(null=True, blank=True, db_index=True, editable=False)
 
+    """
+    Measures of the run, see django_cron.stats.CronJobRunStats.
+    Durations and CPU time are in seconds, peak_rss in kilobytes.
+    """
+    lock_duration = models.FloatField(null=True, blank=True, editable=False)
+    schedule_duration = models.FloatField(null=True, blank=True, editable=False)
+    do_duration = models.FloatField(null=True, blank=True, editable=False)
+    cpu_time = models.FloatField(null=True, blank=True, editable=False)
+    peak_rss = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    query_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
     def __unicode__(self):
         return '%s (%s)' % (self.code, 'Success' if self.is_success else 'Fail')
 
@@ -26,3 +40,183 @@ class CronJobLog(models.Model):
             ('code', 'start_time', 'ran_at_time'),
             ('code', 'start_time')  # useful when finding latest run (order by start_time) of cron
         ]
+
+
+class CronJobStateManager(models.Manager):
+
+    def get_states(self, codes):
+        """
+        Returns a dict of the CronJobState of the given codes, with their
+        last runs, in one query. Missing states are rebuilt from CronJobLog.
+        """
+        states = dict(
+            (state.code, state)
+            for state in self.filter(code__in=codes).select_related('last_run', 'last_success', 'last_failure')
+        )
+        for code in set(codes) - set(states):
+            states[code] = self.rebuild(code)
+        return states
+
+    def record(self, cron_log):
+        """
+        Updates the state of the job with a new, already saved, log row.
+        Has to be called in the transaction that saved the row.
+        """
+        try:
+            state = self.select_for_update().get(code=cron_log.code)
+        except self.model.DoesNotExist:
+            # The state rebuilt from the log table already includes cron_log
+            self.rebuild(cron_log.code)
+        else:
+            state.update(cron_log)
+            state.save()
+
+    def record_many(self, cron_logs):
+        """
+        Updates the states of many jobs with new, already saved, log rows:
+        one query to lock the states, then one UPDATE per job.
+        Has to be called in the transaction that saved the rows.
+        """
+        codes = set(cron_log.code for cron_log in cron_logs)
+        states = dict((state.code, state) for state in self.select_for_update().filter(code__in=codes))
+        for cron_log in sorted(cron_logs, key=lambda x: x.start_time):
+            if cron_log.code in states:
+                states[cron_log.code].update(cron_log)
+        for state in states.values():
+            state.save()
+        for code in codes - set(states):
+            # The state rebuilt from the log table already includes the logs
+            self.rebuild(code)
+
+    def rebuild(self, code):
+        """
+        Creates the state of a job from its CronJobLog rows. Used for jobs
+        that ran before CronJobState existed or that never ran at all.
+        """
+        logs = CronJobLog.objects.filter(code=code)
+        state = self.model(code=code)
+
+        state.last_run = logs.order_by('-start_time', '-pk').first()
+        if state.last_run is not None:
+            state.last_start_time = state.last_run.start_time
+        state.last_success = logs.filter(is_success=True, ran_at_time__isnull=True).order_by('-start_time', '-pk').first()
+        state.last_failure = logs.filter(is_success=False).order_by('-start_time', '-pk').first()
+
+        failures = logs.filter(is_success=False)
+        last_success_end_time = logs.filter(is_success=True).aggregate(end_time=Max('end_time'))['end_time']
+        if last_success_end_time is not None:
+            failures = failures.filter(end_time__gt=last_success_end_time)
+        state.consecutive_failures = failures.count()
+
+        last_ran_at = logs.filter(is_success=True, ran_at_time__isnull=False).order_by('-end_time').first()
+        if last_ran_at is not None:
+            start_of_day = last_ran_at.end_time.replace(hour=0, minute=0, second=0, microsecond=0)
+            ran_at_times = logs.filter(
+                is_success=True,
+                ran_at_time__isnull=False,
+                end_time__gte=start_of_day,
+                end_time__lt=start_of_day + timedelta(days=1)
+            ).values_list('ran_at_time', flat=True).distinct()
+            state.ran_at_date = start_of_day.date()
+            state.ran_at_times = ','.join(sorted('%02d:%02d' % (x.hour, x.minute) for x in ran_at_times))
+
+        try:
+            with transaction.atomic():
+                state.save(force_insert=True)
+        except IntegrityError:
+            # Created meanwhile by another process
+            state = self.get(code=code)
+        return state
+
+
+class CronJobState(models.Model):
+    """
+    Latest state of every cron job, one row per code.
+
+    Updated by CronJobManager.make_log in the same transaction as the
+    CronJobLog row, so that scheduling and notifications don't have to
+    scan the log table.
+    """
+    code = models.CharField(max_length=64, primary_key=True)
+    last_start_time = models.DateTimeField(null=True, blank=True)
+    last_run = models.ForeignKey(CronJobLog, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+
+    """
+    Latest successful run, not counting the run_at_times runs that are
+    tracked by ran_at_date and ran_at_times.
+    """
+    last_success = models.ForeignKey(CronJobLog, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    last_failure = models.ForeignKey(CronJobLog, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+
+    """
+    Date of the latest successful run_at_times run, and comma separated
+    "HH:MM" times that ran successfully on that day.
+    """
+    ran_at_date = models.DateField(null=True, blank=True)
+    ran_at_times = models.CharField(max_length=255, blank=True, default='')
+
+    objects = CronJobStateManager()
+
+    def __unicode__(self):
+        return '%s (%s consecutive failures)' % (self.code, self.consecutive_failures)
+
+    def get_ran_at_times(self, date):
+        """
+        Returns the set of datetime.time that ran successfully on the given date
+        """
+        if self.ran_at_date != date or not self.ran_at_times:
+            return set()
+        return set(datetime_time(*map(int, x.split(':'))) for x in self.ran_at_times.split(','))
+
+    def update(self, cron_log):
+        """
+        Updates the state with a new log row of this job.
+        """
+        if self.last_start_time is None or self.last_start_time <= cron_log.start_time:
+            self.last_start_time = cron_log.start_time
+            self.last_run = cron_log
+
+        if cron_log.is_success:
+            self.consecutive_failures = 0
+            if cron_log.ran_at_time is None:
+                self.last_success = cron_log
+            else:
+                ran_at_date = cron_log.end_time.date()
+                ran_at_times = self.get_ran_at_times(ran_at_date)
+                ran_at_times.add(cron_log.ran_at_time)
+                self.ran_at_date = ran_at_date
+                self.ran_at_times = ','.join(sorted('%02d:%02d' % (x.hour, x.minute) for x in ran_at_times))
+        else:
+            self.consecutive_failures += 1
+            self.last_failure = cron_log
+
+
+class CronJobLock(models.Model):
+    """
+    Locks taken by django_cron.backends.lock.database.DatabaseLock
+    on databases without advisory locks.
+    """
+    job_name = models.CharField(max_length=200, primary_key=True)
+    token = models.CharField(max_length=32)
+    locked_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __unicode__(self):
+        return '%s (locked at %s)' % (self.job_name, self.locked_at)
+
+
+class CronJobQueueEntry(models.Model):
+    """
+    A due cron job waiting for a cronworker, when runcrons only enqueues
+    the due jobs (see django_cron.queue.DatabaseQueue).
+    """
+    code = models.CharField(max_length=64, db_index=True)
+    cron_class = models.CharField(max_length=255)
+    force = models.BooleanField(default=False)
+    enqueued_at = models.DateTimeField()
+    claimed_by = models.CharField(max_length=32, blank=True, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return '%s (%s)' % (self.code, 'claimed' if self.claimed_by else 'pending')
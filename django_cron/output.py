@@ -0,0 +1,127 @@
+from collections import deque
+import gzip
+import tempfile
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import get_storage_class
+from django.utils import timezone
+
+
+MAX_MESSAGE_LENGTH = 1000
+
+
+def get_output_storage():
+    """
+    Returns the storage the full output of the jobs is saved to, set by
+    DJANGO_CRON_OUTPUT_STORAGE, or None when only the tail is kept (default).
+    """
+    path = getattr(settings, 'DJANGO_CRON_OUTPUT_STORAGE', None)
+    if not path:
+        return None
+    return get_storage_class(path)()
+
+
+class CronJobOutput(object):
+    """
+    File-like object a cron job writes its output to, as self.output in do():
+
+        def do(self):
+            for row in rows:
+                self.output.write('Processed %s\n' % row)
+
+    Memory is bounded: only the last `max_length` characters are kept, as
+    a queue of the last written chunks, and stored in CronJobLog.message.
+
+    With a storage (DJANGO_CRON_OUTPUT_STORAGE), the whole output is also
+    gzipped to a temporary file as it is written, and saved to the storage
+    when the run is logged, if it doesn't fit in the message. The message
+    then starts with the name of the saved file.
+    """
+
+    def __init__(self, code=None, storage=None, max_length=MAX_MESSAGE_LENGTH):
+        self.code = code
+        self.storage = storage
+        self.max_length = max_length
+        self.chunks = deque()
+        self.length = 0
+        self.size = 0
+        self.spill_file = None
+        self.gzip_file = None
+        self.name = None
+        self.mutex = threading.Lock()
+
+    def write(self, text):
+        if not text:
+            return
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+
+        with self.mutex:
+            self.size += len(text)
+            if self.storage is not None:
+                if self.gzip_file is None:
+                    self.spill_file = tempfile.TemporaryFile()
+                    self.gzip_file = gzip.GzipFile(fileobj=self.spill_file, mode='wb')
+                self.gzip_file.write(text.encode('utf-8'))
+
+            text = text[-self.max_length:]
+            self.chunks.append(text)
+            self.length += len(text)
+            # Drop the chunks that are no longer part of the tail
+            while self.length - len(self.chunks[0]) >= self.max_length:
+                self.length -= len(self.chunks.popleft())
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        """
+        Returns the last `max_length` characters of the output.
+        """
+        with self.mutex:
+            return ''.join(self.chunks)[-self.max_length:]
+
+    def save(self):
+        """
+        Saves the full output to the storage, if it doesn't fit in the
+        message, and returns the name of the saved file (None otherwise).
+        """
+        with self.mutex:
+            if self.gzip_file is None:
+                return self.name
+            try:
+                self.gzip_file.close()
+                if self.size > self.max_length:
+                    self.spill_file.seek(0)
+                    self.name = self.storage.save(self.get_name(), File(self.spill_file))
+            finally:
+                self.spill_file.close()
+                self.gzip_file = self.spill_file = None
+            return self.name
+
+    def get_name(self):
+        return 'django_cron/%s/%s-%s.log.gz' % (
+            self.code or 'output', timezone.now().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8]
+        )
+
+    def get_state(self):
+        """
+        Saves the output and returns what is needed to restore it in another
+        process (see CronJobManager.run_with_output).
+        """
+        name = self.save()
+        return {'tail': self.getvalue(), 'size': self.size, 'name': name}
+
+    def set_state(self, state):
+        with self.mutex:
+            self.chunks = deque([state['tail']])
+            self.length = len(state['tail'])
+            self.size = state['size']
+            self.name = state['name']
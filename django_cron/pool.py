@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+
+try:
+    from django.db import close_old_connections as close_connection
+except ImportError:
+    from django.db import close_connection
+
+
+logger = logging.getLogger('django_cron')
+
+
+class CronJobPool(object):
+    """
+    Runs cron jobs concurrently in a pool of worker threads.
+
+    Every job gets its own thread (and so its own database connection, which
+    is closed when the job is done); at most `workers` of them run at once.
+    A job still running after `timeout` seconds is abandoned: its thread is
+    a daemon and can't be killed, but it no longer holds a worker slot and
+    doesn't keep run() from returning.
+    """
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, workers, timeout=None):
+        self.workers = max(int(workers), 1)
+        self.timeout = timeout
+
+    def run(self, target, cron_classes, **kwargs):
+        """
+        Calls target(cron_class, **kwargs) for every cron class and returns
+        once all calls are finished or timed out.
+
+        Returns the list of cron classes that timed out.
+        """
+        pending = list(cron_classes)
+        running = []
+        timed_out = []
+
+        while pending or running:
+            for job in list(running):
+                thread, cron_class, started = job
+                if not thread.is_alive():
+                    running.remove(job)
+                    pending.extend(self.job_done(cron_class, pending))
+                elif self.timeout and time.time() - started > self.timeout:
+                    logger.error("%s: still running after %s seconds, no longer waiting for it.", cron_class.__name__, self.timeout)
+                    running.remove(job)
+                    timed_out.append(cron_class)
+
+            for cron_class in list(pending):
+                if len(running) >= self.workers:
+                    break
+                if self.is_ready(cron_class, pending, [job[1] for job in running]):
+                    pending.remove(cron_class)
+                    running.append((self.start_job(target, cron_class, **kwargs), cron_class, time.time()))
+
+            if running:
+                running[0][0].join(self.POLL_INTERVAL)
+
+        return timed_out
+
+    def is_ready(self, cron_class, pending, running):
+        """
+        Returns whether the pending cron class can start now.
+        """
+        return True
+
+    def start_job(self, target, cron_class, **kwargs):
+        thread = threading.Thread(target=self.run_job, args=(target, cron_class), kwargs=kwargs)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def job_done(self, cron_class, pending):
+        """
+        Called when the job of a cron class is finished, returns cron classes to run next.
+        """
+        return []
+
+    def run_job(self, target, cron_class, **kwargs):
+        try:
+            target(cron_class, **kwargs)
+        except Exception:
+            logger.exception("%s: unexpected error in worker thread", cron_class.__name__)
+        finally:
+            close_connection()
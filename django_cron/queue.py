@@ -0,0 +1,153 @@
+from collections import deque, namedtuple
+from datetime import timedelta
+import threading
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+from django_cron import get_class
+from django_cron.models import CronJobQueueEntry
+
+
+DEFAULT_CLAIM_TIMEOUT = 60 * 60  # 1 hour
+
+QueuedCronJob = namedtuple('QueuedCronJob', ['id', 'code', 'cron_class', 'force', 'enqueued_at'])
+
+
+def get_queue():
+    """
+    Returns the queue set by DJANGO_CRON_QUEUE, or None when runcrons
+    runs the due jobs itself (default).
+    """
+    path = getattr(settings, 'DJANGO_CRON_QUEUE', None)
+    if not path:
+        return None
+    return get_class(path)()
+
+
+def get_class_path(cron_class):
+    return '%s.%s' % (cron_class.__module__, cron_class.__name__)
+
+
+class BaseCronJobQueue(object):
+    """
+    Holds the due cron jobs between runcrons, which enqueues them, and the
+    cronworker processes, which claim and run them.
+
+    A job is enqueued at most once: until a worker is done with it, it is not
+    enqueued again. A claimed job whose worker is not done with it after
+    DJANGO_CRON_QUEUE_CLAIM_TIMEOUT seconds is considered lost, and
+    can be enqueued again.
+    """
+
+    def __init__(self):
+        self.claim_timeout = getattr(settings, 'DJANGO_CRON_QUEUE_CLAIM_TIMEOUT', DEFAULT_CLAIM_TIMEOUT)
+
+    def put(self, cron_classes, force=False):
+        """
+        Enqueues the given cron classes, except those already in the queue.
+        Returns the number of enqueued jobs.
+        """
+        raise NotImplementedError('You have to implement put(self, cron_classes, force) method for your class')
+
+    def claim(self, limit):
+        """
+        Claims at most `limit` queued jobs for this worker, oldest first,
+        and returns them as QueuedCronJob. A job is claimed by one worker only.
+        """
+        raise NotImplementedError('You have to implement claim(self, limit) method for your class')
+
+    def done(self, jobs):
+        """
+        Removes the given claimed jobs from the queue.
+        """
+        raise NotImplementedError('You have to implement done(self, jobs) method for your class')
+
+
+class DatabaseQueue(BaseCronJobQueue):
+    """
+    Queue in the CronJobQueueEntry table, shared by all the hosts using the
+    database. Every method runs a fixed number of queries, whatever the
+    number of jobs.
+    """
+
+    def put(self, cron_classes, force=False):
+        now = timezone.now()
+        CronJobQueueEntry.objects.filter(claimed_at__lt=now - timedelta(seconds=self.claim_timeout)).delete()
+
+        codes = set(cron_class.code for cron_class in cron_classes)
+        queued = set(CronJobQueueEntry.objects.filter(code__in=codes).values_list('code', flat=True))
+
+        entries = []
+        for cron_class in cron_classes:
+            if cron_class.code not in queued:
+                queued.add(cron_class.code)
+                entries.append(CronJobQueueEntry(
+                    code=cron_class.code, cron_class=get_class_path(cron_class), force=bool(force), enqueued_at=now
+                ))
+        CronJobQueueEntry.objects.bulk_create(entries)
+        return len(entries)
+
+    def claim(self, limit):
+        pending = CronJobQueueEntry.objects.filter(claimed_by='')
+        ids = list(pending.order_by('id').values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+
+        # Entries claimed by another worker meanwhile are not updated
+        token = uuid.uuid4().hex
+        pending.filter(id__in=ids).update(claimed_by=token, claimed_at=timezone.now())
+        return [
+            QueuedCronJob(*values) for values in CronJobQueueEntry.objects.filter(claimed_by=token).order_by('id').values_list(
+                'id', 'code', 'cron_class', 'force', 'enqueued_at'
+            )
+        ]
+
+    def done(self, jobs):
+        CronJobQueueEntry.objects.filter(id__in=[job.id for job in jobs]).delete()
+
+
+class LocalQueue(BaseCronJobQueue):
+    """
+    In-process stand-in for DatabaseQueue, for tests and for running the
+    scheduler and the workers in the same process.
+    """
+    jobs = deque()
+    claimed = {}
+    mutex = threading.Lock()
+    counter = 0
+
+    def put(self, cron_classes, force=False):
+        now = timezone.now()
+        with self.mutex:
+            queued = set(job.code for job in self.jobs)
+            for job, claimed_at in list(self.claimed.items()):
+                if claimed_at < now - timedelta(seconds=self.claim_timeout):
+                    del self.claimed[job]
+                else:
+                    queued.add(job.code)
+
+            count = 0
+            for cron_class in cron_classes:
+                if cron_class.code not in queued:
+                    queued.add(cron_class.code)
+                    LocalQueue.counter += 1
+                    self.jobs.append(QueuedCronJob(LocalQueue.counter, cron_class.code, get_class_path(cron_class), bool(force), now))
+                    count += 1
+            return count
+
+    def claim(self, limit):
+        now = timezone.now()
+        with self.mutex:
+            jobs = []
+            while self.jobs and len(jobs) < limit:
+                job = self.jobs.popleft()
+                self.claimed[job] = now
+                jobs.append(job)
+            return jobs
+
+    def done(self, jobs):
+        with self.mutex:
+            for job in jobs:
+                self.claimed.pop(job, None)
@@ -0,0 +1,255 @@
+import logging
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import receiver
+
+from django_cron import DEFAULT_LOCK_BACKEND, CronJobBase, Schedule, get_class
+from django_cron.backends.lock.base import DjangoCronJobLock
+from django_cron.graph import CronJobGraph
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    # Moved in Django 1.8
+    from django.test.signals import setting_changed
+
+
+logger = logging.getLogger('django_cron')
+
+registry = None
+registry_mutex = threading.Lock()
+
+
+class LazyCronJob(object):
+    """
+    Stands for a cron class declared in CRON_CLASSES with its code and
+    schedule, so that it can be scheduled without importing its module:
+
+        CRON_CLASSES = [
+            'app.cron.MyCronJob',
+            {
+                'class': 'reports.cron.HeavyReportCronJob',
+                'code': 'reports.heavy',
+                'schedule': {'run_at_times': ['03:00']},
+                'MIN_NUM_FAILURES': 3,
+            },
+        ]
+
+    The class is only imported by resolve(), when the job is due. The
+    declared code, schedule and other attributes are set on the class
+    when it doesn't define them itself.
+
+    Only the declared attributes are available before resolve(), anything
+    else raises AttributeError like for a class that doesn't define it.
+    """
+
+    def __init__(self, path, code, schedule=None, **attrs):
+        self.path = path
+        self.code = code
+        if schedule is None and not attrs.get('DEPENDS_ON'):
+            raise ValueError('%s needs a schedule' % path)
+        if schedule is not None and not isinstance(schedule, Schedule):
+            schedule = Schedule(**schedule)
+        self.schedule = schedule
+        self.attrs = attrs
+        self.cron_class = None
+        self.__name__ = path.rsplit('.', 1)[-1]
+        self.__module__ = path.rsplit('.', 1)[0]
+
+    @classmethod
+    def from_entry(cls, entry):
+        entry = dict(entry)
+        return cls(entry.pop('class'), **entry)
+
+    def resolve(self):
+        """
+        Imports the cron class and returns it.
+        """
+        if self.cron_class is None:
+            cron_class = get_class(self.path)
+            code = getattr(cron_class, 'code', self.code)
+            if code != self.code:
+                raise Exception('%s has code %s, but is declared with code %s in CRON_CLASSES' % (self.path, code, self.code))
+            declared = dict(self.attrs, code=self.code, schedule=self.schedule)
+            for name, value in declared.items():
+                if value is not None and not hasattr(cron_class, name):
+                    setattr(cron_class, name, value)
+            self.cron_class = cron_class
+        return self.cron_class
+
+    def __getattr__(self, name):
+        attrs = self.__dict__.get('attrs', {})
+        if name in attrs:
+            return attrs[name]
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return '<LazyCronJob %s>' % self.path
+
+
+def load_cron_class(entry):
+    """
+    Returns the cron class of a CRON_CLASSES entry: a LazyCronJob for the
+    dicts declaring a code and a schedule, the class itself for the paths.
+    """
+    if isinstance(entry, dict):
+        return LazyCronJob.from_entry(entry)
+    return get_class(entry)
+
+
+def load_cron_classes(entries=None):
+    """
+    Returns the cron classes of the given CRON_CLASSES entries, by default
+    those of the registry, loaded once.
+    """
+    if entries is None:
+        return list(get_registry().cron_classes)
+    return [load_cron_class(entry) for entry in entries]
+
+
+def get_cron_class(path):
+    """
+    Returns the cron class with the given path, resolving the CRON_CLASSES
+    declaration of the class if there is one.
+    """
+    cron_class = get_registry().cron_classes_by_path.get(path)
+    if cron_class is None:
+        return get_class(path)
+    return resolve_cron_class(cron_class)
+
+
+def resolve_cron_class(cron_class):
+    if isinstance(cron_class, LazyCronJob):
+        return cron_class.resolve()
+    return cron_class
+
+
+def get_cron_class_attribute(cron_class, name, default=None):
+    """
+    Returns an attribute of a cron class, read from its CRON_CLASSES
+    declaration when it declares it, so that the module of the class is
+    only imported for the attributes that are not declared. Returns the
+    default when the declared value is None, or when that import fails.
+    """
+    if isinstance(cron_class, LazyCronJob):
+        if cron_class.cron_class is None and name in cron_class.attrs:
+            # Declared as None to get the default without importing the class
+            value = cron_class.attrs[name]
+            return default if value is None else value
+        try:
+            cron_class = cron_class.resolve()
+        except Exception:
+            logger.exception("Error importing %s", cron_class.path)
+            return default
+    return getattr(cron_class, name, default)
+
+
+def get_module_name(entry):
+    if isinstance(entry, dict):
+        entry = entry['class']
+    return entry.rsplit('.', 1)[0]
+
+
+def get_registry():
+    """
+    Returns the CronJobRegistry of the settings, built once (by
+    DjangoCronConfig.ready) and again when the settings change in tests.
+    """
+    global registry
+
+    with registry_mutex:
+        if registry is None:
+            registry = CronJobRegistry(
+                getattr(settings, 'CRON_CLASSES', []),
+                getattr(settings, 'DJANGO_CRON_LOCK_BACKEND', None),
+                getattr(settings, 'DJANGO_CRON_LEADER_LEASE_TTL', None),
+            )
+        return registry
+
+
+@receiver(setting_changed)
+def reset_registry(setting, **kwargs):
+    global registry
+
+    if setting in ('CRON_CLASSES', 'DJANGO_CRON_LOCK_BACKEND', 'DJANGO_CRON_LEADER_LEASE_TTL'):
+        with registry_mutex:
+            registry = None
+
+
+class CronJobRegistry(object):
+    """
+    The cron classes of CRON_CLASSES and the lock backend, loaded and
+    checked once: every entry must be a cron class with a code and a
+    schedule (or DEPENDS_ON), the codes must be unique, DEPENDS_ON must
+    form a graph without cycles (see CronJobGraph), and the lock backend
+    must be a DjangoCronJobLock, implementing lease() when leader election
+    is enabled. ImproperlyConfigured is raised otherwise.
+
+    Classes declared lazily (see LazyCronJob) are checked from their
+    declaration, their modules are not imported. The time taken to import
+    the other modules is kept in import_times, for runcrons --profile-startup.
+    """
+
+    def __init__(self, entries, lock_backend=None, leader_lease_ttl=None):
+        self.cron_classes = []
+        self.cron_classes_by_path = {}
+        # Seconds and number of modules imported, by module name
+        self.import_times = {}
+        for entry in entries:
+            try:
+                module_name = None if isinstance(entry, dict) else get_module_name(entry)
+                modules_count = len(sys.modules)
+                started = time.time()
+                cron_class = load_cron_class(entry)
+            except Exception as e:
+                raise ImproperlyConfigured('Invalid CRON_CLASSES entry %r: %s' % (entry, e))
+            if module_name is not None and len(sys.modules) > modules_count:
+                self.import_times[module_name] = (time.time() - started, len(sys.modules) - modules_count)
+            self.check_cron_class(entry, cron_class)
+            self.cron_classes.append(cron_class)
+            self.cron_classes_by_path['%s.%s' % (cron_class.__module__, cron_class.__name__)] = cron_class
+
+        codes = {}
+        for cron_class in self.cron_classes:
+            codes.setdefault(cron_class.code, []).append(cron_class.__name__)
+        duplicates = ['%s (%s)' % (code, ', '.join(names)) for code, names in sorted(codes.items()) if len(names) > 1]
+        if duplicates:
+            raise ImproperlyConfigured('Duplicate codes in CRON_CLASSES: %s' % '; '.join(duplicates))
+
+        self.graph = CronJobGraph(self.cron_classes)
+        self.lock_class = self.get_lock_class(lock_backend)
+        if leader_lease_ttl and not self.supports_lease(self.lock_class):
+            raise ImproperlyConfigured(
+                'DJANGO_CRON_LEADER_LEASE_TTL needs a lock backend supporting leases, %s does not' % self.lock_class.__name__
+            )
+
+    @staticmethod
+    def check_cron_class(entry, cron_class):
+        if isinstance(cron_class, LazyCronJob):
+            return
+        if not isinstance(cron_class, type) or not issubclass(cron_class, CronJobBase):
+            raise ImproperlyConfigured('CRON_CLASSES entry %r is not a subclass of %s' % (entry, CronJobBase.__name__))
+        required = ('code',) if getattr(cron_class, 'DEPENDS_ON', None) else ('code', 'schedule')
+        for name in required:
+            if not hasattr(cron_class, name):
+                raise ImproperlyConfigured('CRON_CLASSES entry %r has no %s' % (entry, name))
+
+    @staticmethod
+    def get_lock_class(lock_backend):
+        lock_backend = lock_backend or DEFAULT_LOCK_BACKEND
+        try:
+            lock_class = get_class(lock_backend)
+        except Exception as e:
+            raise ImproperlyConfigured('Invalid DJANGO_CRON_LOCK_BACKEND: %s' % e)
+        if not isinstance(lock_class, type) or not issubclass(lock_class, DjangoCronJobLock):
+            raise ImproperlyConfigured('DJANGO_CRON_LOCK_BACKEND %s is not a subclass of %s' % (lock_backend, DjangoCronJobLock.__name__))
+        return lock_class
+
+    @staticmethod
+    def supports_lease(lock_class):
+        lease = lock_class.lease
+        # Unbound methods wrap the function on Python 2
+        return getattr(lease, '__func__', lease) is not DjangoCronJobLock.__dict__['lease']
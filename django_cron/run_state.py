@@ -0,0 +1,197 @@
+from datetime import time as datetime_time
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from django_cron.models import CronJobState
+
+try:
+    from django.core.cache import caches
+except ImportError:
+    # `caches` added in 1.7
+    from django.core.cache import get_cache
+
+
+DEFAULT_RUN_STATE_CACHE_TIMEOUT = 5 * 60  # 5 minutes
+RUN_STATE_CACHE_KEY = 'django_cron.run_state.%s'
+
+
+def parse_run_at_time(time_data):
+    """
+    Converts a "HH:MM" string from Schedule.run_at_times into a datetime.time
+    """
+    if isinstance(time_data, datetime_time):
+        return time_data
+    parsed = time.strptime(time_data, "%H:%M")
+    return datetime_time(parsed.tm_hour, parsed.tm_min)
+
+
+def get_run_state_cache():
+    """
+    Returns the cache set by DJANGO_CRON_RUN_STATE_CACHE, or None when
+    the run state is not cached (default).
+    """
+    cache_name = getattr(settings, 'DJANGO_CRON_RUN_STATE_CACHE', None)
+    if cache_name is None:
+        return None
+    try:
+        # Django >= 1.7.*
+        return caches[cache_name]
+    except NameError:
+        # Django <= 1.6.*
+        return get_cache(cache_name)
+
+
+def get_run_state_cache_timeout():
+    return getattr(settings, 'DJANGO_CRON_RUN_STATE_CACHE_TIMEOUT', DEFAULT_RUN_STATE_CACHE_TIMEOUT)
+
+
+class CronJobRunState(object):
+    """
+    Snapshot of the previous runs of a set of cron jobs.
+
+    Holds everything CronJobManager.should_run_now needs to know:
+    + the latest run (success or not) of every job
+    + the latest successful run of every job, except the run_at_times ones
+    + the run_at_times that already ran successfully today
+
+    Use CronJobRunState.load() to fetch the state of many jobs at once:
+    it is read from the CronJobState table in a single query.
+
+    When DJANGO_CRON_RUN_STATE_CACHE names a cache, the state of every job
+    is also kept there for DJANGO_CRON_RUN_STATE_CACHE_TIMEOUT seconds and
+    updated by CronJobManager.make_log (see CronJobRunState.record), so that
+    the database is only read on cache misses. The database stays the source
+    of truth: use CronJobRunState.invalidate() after changing CronJobLog rows
+    by other means.
+    """
+
+    def __init__(self, now=None, last_jobs=None, last_successes=None, ran_at_times=None):
+        self.now = now or timezone.now()
+        self.last_jobs = last_jobs or {}
+        self.last_successes = last_successes or {}
+        self.ran_at_times = ran_at_times or {}
+
+    @classmethod
+    def load(cls, cron_classes, now=None):
+        """
+        Loads the state of all given cron classes.
+
+        Runs a single query, whatever the number of classes (plus a few
+        to rebuild the CronJobState of jobs seen for the first time).
+        Jobs found in the run state cache are not queried at all.
+
+        The state of the jobs listed in DEPENDS_ON is loaded too.
+        """
+        run_state = cls(now)
+        codes = set()
+        for cron_class in cron_classes:
+            codes.add(cron_class.code)
+            codes.update(getattr(cron_class, 'DEPENDS_ON', None) or ())
+
+        cache = get_run_state_cache()
+        if cache is None:
+            run_state.load_from_database(codes)
+            return run_state
+
+        cached = cache.get_many([RUN_STATE_CACHE_KEY % code for code in codes])
+        for code in codes:
+            entry = cached.get(RUN_STATE_CACHE_KEY % code)
+            if entry is not None:
+                run_state.set_entry(code, entry)
+
+        missing = [code for code in codes if RUN_STATE_CACHE_KEY % code not in cached]
+        if missing:
+            run_state.load_from_database(missing)
+            cache.set_many(
+                dict((RUN_STATE_CACHE_KEY % code, run_state.get_entry(code)) for code in missing),
+                get_run_state_cache_timeout()
+            )
+        return run_state
+
+    def load_from_database(self, codes):
+        """
+        Reads the state of the given job codes from CronJobState,
+        in one query.
+        """
+        today = self.now.date()
+        states = CronJobState.objects.get_states(set(codes))
+        for code, state in states.items():
+            if state.last_run is not None:
+                self.last_jobs[code] = state.last_run
+            if state.last_success is not None:
+                self.last_successes[code] = state.last_success
+            ran_at_times = state.get_ran_at_times(today)
+            if ran_at_times:
+                self.ran_at_times[code] = ran_at_times
+
+    def get_last_job(self, code):
+        return self.last_jobs.get(code)
+
+    def get_last_success(self, code):
+        return self.last_successes.get(code)
+
+    def has_ran_at_time(self, code, time_data):
+        return parse_run_at_time(time_data) in self.ran_at_times.get(code, ())
+
+    def get_entry(self, code):
+        """
+        Returns the state of one job in the format stored in the run state cache.
+        """
+        return {
+            'last_job': self.last_jobs.get(code),
+            'last_success': self.last_successes.get(code),
+            'ran_at_date': self.now.date(),
+            'ran_at_times': self.ran_at_times.get(code, set()),
+        }
+
+    def set_entry(self, code, entry):
+        if entry['last_job'] is not None:
+            self.last_jobs[code] = entry['last_job']
+        if entry['last_success'] is not None:
+            self.last_successes[code] = entry['last_success']
+        if entry['ran_at_date'] == self.now.date() and entry['ran_at_times']:
+            self.ran_at_times[code] = entry['ran_at_times']
+
+    @classmethod
+    def record(cls, cron_log):
+        """
+        Writes a new CronJobLog through to the run state cache, if any.
+
+        Jobs that are not cached yet are left alone: they will be loaded
+        from the database on the next lookup.
+        """
+        cache = get_run_state_cache()
+        if cache is None:
+            return
+
+        key = RUN_STATE_CACHE_KEY % cron_log.code
+        entry = cache.get(key)
+        if entry is None:
+            return
+
+        last_job = entry['last_job']
+        if last_job is None or last_job.start_time <= cron_log.start_time:
+            entry['last_job'] = cron_log
+
+        if cron_log.is_success:
+            if cron_log.ran_at_time is None:
+                entry['last_success'] = cron_log
+            else:
+                ran_at_date = cron_log.end_time.date()
+                if entry['ran_at_date'] != ran_at_date:
+                    entry['ran_at_date'] = ran_at_date
+                    entry['ran_at_times'] = set()
+                entry['ran_at_times'].add(parse_run_at_time(cron_log.ran_at_time))
+
+        cache.set(key, entry, get_run_state_cache_timeout())
+
+    @classmethod
+    def invalidate(cls, codes):
+        """
+        Drops the cached state of the given job codes.
+        """
+        cache = get_run_state_cache()
+        if cache is not None:
+            cache.delete_many([RUN_STATE_CACHE_KEY % code for code in codes])
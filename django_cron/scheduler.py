@@ -0,0 +1,125 @@
+import heapq
+import itertools
+import time
+
+from django_cron import CronJobBase, CronJobManager, metrics
+from django_cron.registry import LazyCronJob
+from django_cron.run_state import CronJobRunState
+
+
+class CronJobScheduler(object):
+    """
+    Evaluates the schedules of many cron job classes at once.
+
+    The previous runs of all the jobs are loaded with a few grouped queries
+    (see CronJobRunState.load) and every schedule is then checked in memory,
+    instead of querying the database job by job.
+    """
+
+    def __init__(self, cron_classes):
+        self.cron_classes = list(cron_classes)
+
+    def load_run_state(self, now=None):
+        # Classes that are not cron jobs are left for CronJobManager.run to reject
+        cron_jobs = [cron_class for cron_class in self.cron_classes if self.is_cron_job(cron_class)]
+        return CronJobRunState.load(cron_jobs, now)
+
+    def get_due_cron_classes(self, force=False, run_state=None):
+        """
+        Returns the cron classes that should run now, in their original order.
+
+        This is only a pre-filter: CronJobManager.run checks the schedule again
+        once the job lock is held, so runs of other processes are not missed.
+        """
+        if force:
+            return list(self.cron_classes)
+
+        started = time.time()
+        if run_state is None:
+            run_state = self.load_run_state()
+
+        due_cron_classes = []
+        for cron_class in self.cron_classes:
+            if not self.is_cron_job(cron_class):
+                due_cron_classes.append(cron_class)
+            elif CronJobManager(cron_class, run_state=run_state).should_run_now():
+                due_cron_classes.append(cron_class)
+        metrics.observe('django_cron.schedule_evaluation', time.time() - started)
+        return due_cron_classes
+
+    def get_next_run_time(self, run_state=None):
+        """
+        Returns the earliest next run time of all the cron classes,
+        or None if none of them has anything scheduled.
+        """
+        if run_state is None:
+            run_state = self.load_run_state()
+
+        next_run_times = []
+        for cron_class in self.cron_classes:
+            if self.is_cron_job(cron_class):
+                next_run_time = CronJobManager(cron_class, run_state=run_state).next_run_time()
+                if next_run_time is not None:
+                    next_run_times.append(next_run_time)
+        return min(next_run_times) if next_run_times else None
+
+    def build_index(self, run_state=None):
+        """
+        Returns a NextRunTimeIndex of all the cron classes.
+        """
+        if run_state is None:
+            run_state = self.load_run_state()
+
+        index = NextRunTimeIndex()
+        index.push([x for x in self.cron_classes if self.is_cron_job(x)], run_state)
+        return index
+
+    @staticmethod
+    def is_cron_job(cron_class):
+        if isinstance(cron_class, LazyCronJob):
+            return True
+        return isinstance(cron_class, type) and issubclass(cron_class, CronJobBase)
+
+
+class NextRunTimeIndex(object):
+    """
+    Min-heap of cron classes ordered by their next run time.
+
+    Only the jobs at the top of the heap whose next run time has passed need
+    to be looked at on a tick (O(log n) each); the other schedules are not
+    evaluated again until they become due.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.indexed = set()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, cron_classes, run_state):
+        """
+        (Re)inserts the cron classes with the next run time computed from run_state.
+        Classes that have nothing scheduled, or are already in the index, are left out.
+        """
+        for cron_class in cron_classes:
+            if cron_class in self.indexed:
+                continue
+            next_run_time = CronJobManager(cron_class, run_state=run_state).next_run_time()
+            if next_run_time is not None:
+                heapq.heappush(self.heap, (next_run_time, next(self.counter), cron_class))
+                self.indexed.add(cron_class)
+
+    def pop_due(self, now):
+        """
+        Removes and returns the cron classes whose next run time is not after now.
+        """
+        cron_classes = []
+        while self.heap and self.heap[0][0] <= now:
+            cron_classes.append(heapq.heappop(self.heap)[2])
+        self.indexed.difference_update(cron_classes)
+        return cron_classes
+
+    def get_next_run_time(self):
+        return self.heap[0][0] if self.heap else None
@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+import sys
+import time
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+def get_cpu_time():
+    """
+    Returns the CPU time (user + system) used by the current thread when the
+    platform tells it, by the whole process otherwise, and by its finished
+    child processes (do() runs in one when it has a timeout).
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF))
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def get_peak_rss():
+    """
+    Returns the peak resident set size of the process in kilobytes.
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS reports bytes
+        peak_rss //= 1024
+    return peak_rss
+
+
+class CountingCursorWrapper(object):
+    """
+    Cursor counting the queries it runs in a QueryCounter.
+    """
+
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def execute(self, *args, **kwargs):
+        self.counter.count += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.counter.count += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+
+class QueryCounter(object):
+    """
+    Counts the queries run on a connection while in the block, by wrapping
+    the cursors it returns. Unlike the query log of the debug cursor, this
+    keeps no SQL and has no size limit.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.count = 0
+
+    def __enter__(self):
+        # An instance attribute (e.g. of an outer QueryCounter) is restored on exit
+        self.previous = self.connection.__dict__.get('cursor')
+        make_cursor = self.connection.cursor
+        self.connection.cursor = lambda *args, **kwargs: CountingCursorWrapper(make_cursor(*args, **kwargs), self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.previous is None:
+            del self.connection.cursor
+        else:
+            self.connection.cursor = self.previous
+
+
+class CronJobRunStats(object):
+    """
+    Measures the phases of a cron job run, stored with its CronJobLog:
+    + lock_duration - waiting for the lock
+    + schedule_duration - should_run_now
+    + do_duration - do()
+    + cpu_time - CPU seconds used by do()
+    + peak_rss - peak memory of the process when do() ended (kB)
+    + query_count - database queries run by do() on the default connection
+    """
+    FIELDS = ('lock_duration', 'schedule_duration', 'do_duration', 'cpu_time', 'peak_rss', 'query_count')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+
+    @contextmanager
+    def measure(self, phase):
+        """
+        Stores the duration of the block in <phase>_duration, even if it raises.
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            setattr(self, '%s_duration' % phase, time.time() - started)
+
+    @contextmanager
+    def measure_job(self):
+        """
+        Measures the duration, CPU time, memory and queries of do().
+        """
+        cpu_time = get_cpu_time()
+        queries = QueryCounter(connections[DEFAULT_DB_ALIAS])
+        try:
+            with queries, self.measure('do'):
+                yield
+        finally:
+            self.query_count = queries.count
+            if cpu_time is not None:
+                self.cpu_time = get_cpu_time() - cpu_time
+            self.peak_rss = get_peak_rss()
+
+    def apply(self, cron_log):
+        for field in self.FIELDS:
+            setattr(cron_log, field, getattr(self, field))
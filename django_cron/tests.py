@@ -1,19 +1,43 @@
+import gzip
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
 import threading
-from time import sleep
-from datetime import timedelta
+from time import sleep, time
+from datetime import date, datetime, timedelta
 
 from django import db
 from django.utils import unittest
+from django.core import mail
 from django.core.management import call_command
-from django.test.utils import override_settings
+from django.test.utils import override_settings, CaptureQueriesContext
 from django.test.client import Client
 from django.core.urlresolvers import reverse
+from django.core.exceptions import ImproperlyConfigured
+from django.apps import apps
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.core.cache.backends.memcached import PyLibMCCache
 
 from freezegun import freeze_time
 
+from django_cron import CronJobBase, CronJobManager, class_cache, get_class
+from django_cron.backends.lock.cache import CacheLock
+from django_cron.backends.lock.database import DatabaseLock
+from django_cron.cron import FailedRunsNotificationCronJob
+from django_cron.crontab import CronExpression
+from django_cron.daemon import CronJobDaemon
+from django_cron.graph import CronJobGraph
 from django_cron.helpers import humanize_duration
-from django_cron.models import CronJobLog
+from django_cron.leader import LeaderLease
+from django_cron.metrics import get_metrics
+from django_cron.models import CronJobLock, CronJobLog, CronJobQueueEntry, CronJobState
+from django_cron.queue import DatabaseQueue, LocalQueue
+from django_cron.registry import CronJobRegistry, LazyCronJob, get_cron_class, get_registry
+from django_cron.run_state import CronJobRunState
+from django_cron.scheduler import CronJobScheduler
 
 
 class OutBuffer(object):
@@ -33,18 +57,58 @@ class OutBuffer(object):
         return self._str_cache
 
 
+class CasClient(object):
+    """
+    Stands for a pylibmc client with the `cas` behavior, which isn't installed for the tests.
+    """
+    behaviors = {'cas': True}
+
+    def __init__(self):
+        self.values = {}
+        self.cas_id = 0
+
+    def add(self, key, value, time=0):
+        if key in self.values:
+            return False
+        return self.set(key, value, time)
+
+    def set(self, key, value, time=0):
+        self.cas_id += 1
+        self.values[key] = (value, self.cas_id)
+        return True
+
+    def get(self, key):
+        return self.values.get(key, (None, None))[0]
+
+    def gets(self, key):
+        return self.values.get(key, (None, None))
+
+    def cas(self, key, value, cas_id, time=0):
+        if self.gets(key)[1] != cas_id:
+            return False
+        return self.set(key, value, time)
+
+    def delete(self, key):
+        return self.values.pop(key, None) is not None
+
+
 class TestCase(unittest.TestCase):
 
     success_cron = 'test_crons.TestSucessCronJob'
     error_cron = 'test_crons.TestErrorCronJob'
     five_mins_cron = 'test_crons.Test5minsCronJob'
     run_at_times_cron = 'test_crons.TestRunAtTimesCronJob'
+    cron_expression_cron = 'test_crons.TestCronExpressionCronJob'
     wait_3sec_cron = 'test_crons.Wait3secCronJob'
+    wait_3sec_other_cron = 'test_crons.Wait3secOtherCronJob'
     does_not_exist_cron = 'ThisCronObviouslyDoesntExist'
     test_failed_runs_notification_cron = 'django_cron.cron.FailedRunsNotificationCronJob'
 
     def setUp(self):
         CronJobLog.objects.all().delete()
+        CronJobState.objects.all().delete()
+        CronJobLock.objects.all().delete()
+        CronJobQueueEntry.objects.all().delete()
 
     def test_success_cron(self):
         logs_count = CronJobLog.objects.all().count()
@@ -70,6 +134,7 @@ class TestCase(unittest.TestCase):
         logs_count = CronJobLog.objects.all().count()
         call_command('runcrons', self.success_cron, force=True)
         self.assertEqual(CronJobLog.objects.all().count(), logs_count + 1)
+        self.assertTrue(CronJobLog.objects.latest('id').is_success)
 
     def test_runs_every_mins(self):
         logs_count = CronJobLog.objects.all().count()
@@ -101,6 +166,197 @@ class TestCase(unittest.TestCase):
             call_command('runcrons', self.run_at_times_cron)
         self.assertEqual(CronJobLog.objects.all().count(), logs_count + 2)
 
+    def test_batch_schedule_evaluation(self):
+        cron_classes = [get_class(x) for x in (
+            self.success_cron,
+            self.error_cron,
+            self.five_mins_cron,
+            self.run_at_times_cron,
+            self.wait_3sec_cron,
+        )]
+
+        with freeze_time("2014-01-01 00:00:01"):
+            call_command('runcrons', self.five_mins_cron, self.run_at_times_cron, self.error_cron)
+
+        for now in ("2014-01-01 00:03:00", "2014-01-01 00:05:30", "2014-01-02 00:00:30"):
+            with freeze_time(now):
+                expected = [x for x in cron_classes if CronJobManager(x).should_run_now()]
+
+                with CaptureQueriesContext(db.connection) as queries:
+                    due = CronJobScheduler(cron_classes).get_due_cron_classes()
+                self.assertEqual(due, expected)
+                self.assertEqual(len(queries), 1)
+
+    def test_cron_job_state(self):
+        code = get_class(self.error_cron).code
+        for i in range(3):
+            call_command('runcrons', self.error_cron, force=True)
+
+        state = CronJobState.objects.get(code=code)
+        self.assertEqual(state.consecutive_failures, 3)
+        self.assertEqual(state.last_failure, CronJobLog.objects.filter(code=code).latest('start_time'))
+        self.assertIsNone(state.last_success)
+
+        # Rebuilt from the log table when missing
+        state.delete()
+        CronJobLog.objects.create(code=code, start_time=timezone.now(), end_time=timezone.now(), is_success=True)
+        CronJobLog.objects.create(code=code, start_time=timezone.now(), end_time=timezone.now(), is_success=False)
+        state = CronJobState.objects.get_states([code])[code]
+        self.assertEqual(state.consecutive_failures, 1)
+        self.assertEqual(state.last_run, CronJobLog.objects.filter(code=code).latest('pk'))
+
+        with freeze_time("2014-01-01 00:05:01"):
+            call_command('runcrons', self.run_at_times_cron)
+            call_command('runcrons', self.run_at_times_cron)
+        state = CronJobState.objects.get(code=get_class(self.run_at_times_cron).code)
+        self.assertEqual(state.ran_at_date, date(2014, 1, 1))
+        self.assertEqual(state.ran_at_times, '00:00,00:05')
+
+    @override_settings(DJANGO_CRON_RUN_STATE_CACHE='default')
+    def test_run_state_cache(self):
+        cron_class = get_class(self.five_mins_cron)
+        CronJobRunState.invalidate([cron_class.code])
+
+        with freeze_time("2014-01-01 00:00:00"):
+            # Loads the empty state from the database and caches it
+            self.assertTrue(CronJobManager(cron_class).should_run_now())
+            call_command('runcrons', self.five_mins_cron)
+        self.assertEqual(CronJobLog.objects.all().count(), 1)
+
+        # The run was written through to the cache by make_log
+        with freeze_time("2014-01-01 00:04:59"):
+            with CaptureQueriesContext(db.connection) as queries:
+                self.assertFalse(CronJobManager(cron_class).should_run_now())
+            self.assertEqual(len(queries), 0)
+
+        # Deleting logs by hand requires an invalidation
+        CronJobLog.objects.all().delete()
+        with freeze_time("2014-01-01 00:04:59"):
+            self.assertFalse(CronJobManager(cron_class).should_run_now())
+            CronJobRunState.invalidate([cron_class.code])
+            self.assertTrue(CronJobManager(cron_class).should_run_now())
+
+    def test_next_run_time_index(self):
+        cron_classes = [get_class(self.five_mins_cron), get_class(self.run_at_times_cron)]
+
+        with freeze_time("2014-01-01 00:00:01"):
+            call_command('runcrons', self.five_mins_cron, self.run_at_times_cron)
+
+        with freeze_time("2014-01-01 00:01:00"):
+            index = CronJobScheduler(cron_classes).build_index()
+            self.assertEqual(len(index), 2)
+            self.assertEqual(index.get_next_run_time(), datetime(2014, 1, 1, 0, 5))
+            self.assertEqual(
+                CronJobManager(cron_classes[0]).next_run_time(),
+                datetime(2014, 1, 1, 0, 5, 1)
+            )
+
+        self.assertEqual(index.pop_due(datetime(2014, 1, 1, 0, 4)), [])
+        self.assertEqual(index.pop_due(datetime(2014, 1, 1, 0, 5)), [cron_classes[1]])
+        self.assertEqual(index.pop_due(datetime(2014, 1, 1, 0, 6)), [cron_classes[0]])
+        self.assertEqual(index.get_next_run_time(), None)
+
+    def test_daemon(self):
+        cron_classes = [get_class(self.five_mins_cron), get_class(self.run_at_times_cron)]
+        ran = []
+        daemon = CronJobDaemon(cron_classes, ran.extend, min_sleep=1, max_sleep=3600)
+
+        with freeze_time("2014-01-01 00:00:01"):
+            self.assertEqual(daemon.tick(), 1)
+            self.assertEqual(ran, cron_classes)
+            call_command('runcrons', self.five_mins_cron, self.run_at_times_cron)
+
+        with freeze_time("2014-01-01 00:01:01"):
+            self.assertEqual(daemon.tick(), 4 * 60 - 1)  # 0:05 run_at_time
+        self.assertEqual(ran, cron_classes)
+
+        thread = threading.Thread(target=daemon.run)
+        thread.start()
+        sleep(0.1)
+        daemon.stop()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+
+    def test_daemon_failed_job(self):
+        cron_class = get_class(self.error_cron)
+        daemon = CronJobDaemon([cron_class], lambda crons: call_command('runcrons', self.error_cron), min_sleep=1, max_sleep=3600)
+
+        with freeze_time("2014-01-01 00:00:01"):
+            # Not run again before a minute, instead of on every tick
+            self.assertEqual(daemon.tick(), 60)
+            self.assertEqual(daemon.tick(), 60)
+        self.assertEqual(CronJobLog.objects.filter(code='test_error_cron_job').count(), 1)
+
+        with freeze_time("2014-01-01 00:01:01"):
+            daemon.tick()
+        self.assertEqual(CronJobLog.objects.filter(code='test_error_cron_job').count(), 2)
+
+    @override_settings(CRON_CLASSES=[
+        'test_crons.TestUpstreamCronJob', 'test_crons.TestOtherUpstreamCronJob', 'test_crons.TestDownstreamCronJob',
+    ])
+    def test_daemon_depends_on(self):
+        cron_classes = [get_class(x) for x in get_registry().cron_classes_by_path]
+        cron_classes.sort(key=lambda x: x.code)
+        downstream, other_upstream, upstream = cron_classes
+        ran = []
+        daemon = CronJobDaemon([upstream, other_upstream, downstream], ran.extend, min_sleep=1, max_sleep=3600)
+
+        # The downstream job has no schedule, it's due once its upstream jobs succeeded
+        with freeze_time("2014-01-01 00:00:01"):
+            self.assertEqual(daemon.tick(), 1)
+            self.assertEqual(ran, [upstream, other_upstream])
+            call_command('runcrons', 'test_crons.TestUpstreamCronJob', 'test_crons.TestOtherUpstreamCronJob')
+            # Left for the daemon, instead of runcrons starting it after its upstream jobs
+            CronJobLog.objects.filter(code='test_downstream').delete()
+            CronJobState.objects.filter(code='test_downstream').delete()
+
+        with freeze_time("2014-01-01 00:01:01"):
+            del ran[:]
+            # Re-evaluated with its upstream jobs, due on the next tick
+            self.assertEqual(daemon.tick(), 1)
+            self.assertEqual(ran, [upstream, other_upstream])
+        with freeze_time("2014-01-01 00:01:02"):
+            daemon.tick()
+        self.assertEqual(ran, [upstream, other_upstream, upstream, other_upstream, downstream])
+
+    def test_runs_on_cron_expression(self):
+        logs_count = CronJobLog.objects.all().count()
+
+        with freeze_time("2014-01-01 00:10:00"):
+            call_command('runcrons', self.cron_expression_cron)
+        self.assertEqual(CronJobLog.objects.all().count(), logs_count)
+
+        with freeze_time("2014-01-01 00:16:00"):
+            call_command('runcrons', self.cron_expression_cron)
+        self.assertEqual(CronJobLog.objects.all().count(), logs_count + 1)
+
+        with freeze_time("2014-01-01 00:44:59"):
+            call_command('runcrons', self.cron_expression_cron)
+        self.assertEqual(CronJobLog.objects.all().count(), logs_count + 1)
+
+        with freeze_time("2014-01-01 03:00:00"):
+            call_command('runcrons', self.cron_expression_cron)
+        self.assertEqual(CronJobLog.objects.all().count(), logs_count + 2)
+
+    def test_cron_expression(self):
+        expression = CronExpression('*/20 9-17 * * mon-fri')
+        self.assertTrue(expression.matches(datetime(2014, 1, 3, 9, 40)))  # Friday
+        self.assertFalse(expression.matches(datetime(2014, 1, 4, 9, 40)))  # Saturday
+        self.assertEqual(expression.get_next_run_time(datetime(2014, 1, 3, 9, 40)), datetime(2014, 1, 3, 10, 0))
+        self.assertEqual(expression.get_next_run_time(datetime(2014, 1, 3, 17, 45)), datetime(2014, 1, 6, 9, 0))
+
+        # Day of month OR day of week when both are restricted
+        expression = CronExpression('0 0 13 * 5')
+        self.assertEqual(expression.get_next_run_time(datetime(2014, 1, 1)), datetime(2014, 1, 3))
+        self.assertEqual(expression.get_next_run_time(datetime(2014, 1, 10)), datetime(2014, 1, 13))
+
+        self.assertEqual(CronExpression('@yearly').get_next_run_time(datetime(2014, 6, 1)), datetime(2015, 1, 1))
+        self.assertEqual(CronExpression('0 0 29 feb *').get_next_run_time(datetime(2014, 1, 1)), datetime(2016, 2, 29))
+        self.assertIsNone(CronExpression('0 0 30 2 *').get_next_run_time(datetime(2014, 1, 1)))
+
+        for invalid in ('* * * *', '60 * * * *', '* * * foo *', '5-1 * * * *'):
+            self.assertRaises(ValueError, CronExpression, invalid)
+
     def test_admin(self):
         password = 'test'
         user = User.objects.create_superuser(
@@ -120,6 +376,29 @@ class TestCase(unittest.TestCase):
         url = reverse('admin:django_cron_cronjoblog_change', args=(log.id,))
         response = self.client.get(url)
         self.assertIn('Cron job logs', str(response.content))
+        self.assertIn('Query count', str(response.content))
+
+    def test_run_stats(self):
+        logged_queries = len(db.connection.queries)
+        call_command('runcrons', 'test_crons.TestQueryCronJob')
+        log = CronJobLog.objects.get()
+        self.assertEqual(log.query_count, 2)
+        # Not counted from the query log of the debug cursor, which is capped
+        self.assertEqual(len(db.connection.queries), logged_queries)
+        with CaptureQueriesContext(db.connection):
+            db.connection.queries_log.extend({} for i in range(db.connection.queries_limit))
+            call_command('runcrons', 'test_crons.TestQueryCronJob', force=True)
+        self.assertEqual(CronJobLog.objects.latest('id').query_count, 2)
+        CronJobLog.objects.exclude(pk=log.pk).delete()
+        for field in ('lock_duration', 'schedule_duration', 'do_duration', 'cpu_time'):
+            self.assertGreaterEqual(getattr(log, field), 0)
+        self.assertGreater(log.peak_rss, 1024)
+
+        call_command('runcrons', self.error_cron)
+        log = CronJobLog.objects.get(code='test_error_cron_job')
+        # Failed runs are measured too
+        self.assertEqual(log.query_count, 0)
+        self.assertIsNotNone(log.do_duration)
 
     def run_cronjob_in_thread(self, logs_count):
         call_command('runcrons', self.wait_3sec_cron)
@@ -140,6 +419,530 @@ class TestCase(unittest.TestCase):
         t.join(10)
         self.assertEqual(CronJobLog.objects.all().count(), logs_count + 1)
 
+    def test_queue(self):
+        cron_classes = [get_class(x) for x in (self.success_cron, self.five_mins_cron)]
+        for queue_class in (DatabaseQueue, LocalQueue):
+            CronJobLog.objects.all().delete()
+            with override_settings(DJANGO_CRON_QUEUE='%s.%s' % (queue_class.__module__, queue_class.__name__)):
+                call_command('runcrons', self.success_cron, self.five_mins_cron)
+                call_command('runcrons', self.success_cron, self.five_mins_cron)
+                self.assertEqual(CronJobLog.objects.count(), 0)
+
+                # Each job was enqueued once, and is claimed by one worker
+                queue = queue_class()
+                first, second = queue.claim(1), queue.claim(5)
+                self.assertEqual([job.code for job in first + second], [x.code for x in cron_classes])
+                self.assertEqual(queue.claim(5), [])
+                self.assertEqual(queue.put(cron_classes), 0)
+                queue.done(first + second)
+
+                self.assertEqual(queue.put(cron_classes), 2)
+                call_command('cronworker', once=True, workers=2)
+                self.assertEqual(CronJobLog.objects.filter(is_success=True).count(), 2)
+                self.assertEqual(queue.claim(5), [])
+
+                # Entries of classes that no longer exist are dropped, the other jobs run
+                removed = type(str('RemovedCronJob'), (CronJobBase,), {'__module__': 'test_crons', 'code': 'test_removed'})
+                self.assertEqual(queue.put([removed, cron_classes[0]], force=True), 2)
+                call_command('cronworker', once=True, workers=2)
+                self.assertEqual(CronJobLog.objects.filter(is_success=True).count(), 3)
+                self.assertEqual(queue.claim(5), [])
+
+    @override_settings(CRON_CLASSES=[
+        {'class': 'test_lazy_crons.TestLazyCronJob', 'code': 'test_lazy', 'schedule': {'run_every_mins': 5}},
+        {'class': 'test_lazy_crons.DoesNotExist', 'code': 'test_lazy_missing', 'schedule': {'run_every_mins': 5}},
+    ])
+    def test_lazy_cron_classes(self):
+        sys.modules.pop('test_lazy_crons', None)
+        now = timezone.now()
+        for code in ('test_lazy', 'test_lazy_missing'):
+            CronJobLog.objects.create(code=code, start_time=now, end_time=now, is_success=True)
+        call_command('runcrons')
+        self.assertNotIn('test_lazy_crons', sys.modules)
+
+        CronJobLog.objects.all().delete()
+        call_command('runcrons')
+        self.assertIn('test_lazy_crons', sys.modules)
+        log = CronJobLog.objects.get(code='test_lazy')
+        self.assertTrue(log.is_success)
+        self.assertEqual(log.message, 'ran lazily')
+        self.assertEqual(get_class('test_lazy_crons.TestLazyCronJob').code, 'test_lazy')
+        # The failing import is logged like a failed run
+        log = CronJobLog.objects.get(code='test_lazy_missing')
+        self.assertFalse(log.is_success)
+        self.assertIn('DoesNotExist', log.message)
+
+        out = OutBuffer()
+        sys.modules.pop('test_lazy_crons', None)
+        call_command('runcrons', profile_startup=True, stdout=out)
+        self.assertIn('test_lazy_crons (', out.str_content())
+        self.assertIn('total', out.str_content())
+
+    def test_profile_startup(self):
+        sys.modules.pop('test_lazy_crons', None)
+        class_cache.pop('test_lazy_crons.TestProfiledCronJob', None)
+        out = OutBuffer()
+        with override_settings(CRON_CLASSES=['test_lazy_crons.TestProfiledCronJob', self.success_cron]):
+            # Imported when Django starts, before runcrons runs
+            get_registry()
+            self.assertIn('test_lazy_crons', sys.modules)
+            call_command('runcrons', profile_startup=True, stdout=out)
+        self.assertRegexpMatches(out.str_content(), r'[0-9.]+s  test_lazy_crons \(\d+ modules\)')
+        self.assertIn('test_crons (already imported)', out.str_content())
+
+    def test_output(self):
+        manager = CronJobManager(get_class(self.success_cron))
+        self.assertEqual(manager.make_log_msg('a' * 990, 'b' * 10, 'c'), 'a' * 990 + '\n...\nbbbbb')
+        self.assertEqual(manager.make_log_msg('', 'b' * 2000), 'b' * 1000)
+
+        call_command('runcrons', 'test_crons.TestOutputCronJob')
+        message = CronJobLog.objects.get(code='test_output').message
+        self.assertEqual(len(message), 1000)
+        self.assertTrue(message.startswith('done\n...\n'))
+        self.assertTrue(message.endswith('line 4998\nline 4999\n'))
+
+        location = tempfile.mkdtemp()
+        try:
+            with override_settings(
+                DJANGO_CRON_OUTPUT_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_ROOT=location
+            ):
+                call_command('runcrons', 'test_crons.TestOutputCronJob', 'test_crons.TestTimeoutOutputCronJob')
+            for code in ('test_output', 'test_timeout_output'):
+                message = CronJobLog.objects.filter(code=code).latest('id').message
+                self.assertTrue(message.startswith('Full output: django_cron/%s/' % code))
+                self.assertTrue(message.endswith('line 4999\n'))
+                name = message.split('\n')[0][len('Full output: '):]
+                with gzip.open(os.path.join(location, name)) as f:
+                    lines = f.read().decode('utf-8').splitlines()
+                self.assertEqual(len(lines), 5000)
+                self.assertEqual(lines[0], 'line 0')
+        finally:
+            shutil.rmtree(location)
+
+    @override_settings(CRON_CLASSES=[
+        'test_crons.TestDownstreamCronJob', 'test_crons.TestUpstreamCronJob', 'test_crons.TestOtherUpstreamCronJob',
+        'test_crons.TestAfterErrorCronJob', 'test_crons.TestErrorCronJob',
+    ])
+    def test_depends_on(self):
+        started = time()
+        call_command('runcrons', workers=2)
+        # The upstream jobs ran in parallel, the downstream one right after them
+        self.assertLess(time() - started, 1.9)
+        logs = dict((log.code, log) for log in CronJobLog.objects.all())
+        self.assertEqual(sorted(logs), ['test_downstream', 'test_error_cron_job', 'test_other_upstream', 'test_upstream'])
+        self.assertTrue(logs['test_downstream'].is_success)
+        self.assertGreaterEqual(logs['test_downstream'].start_time, logs['test_upstream'].end_time)
+        self.assertGreaterEqual(logs['test_downstream'].start_time, logs['test_other_upstream'].end_time)
+
+        # Due again once all its upstream jobs succeeded again
+        call_command('runcrons', 'test_crons.TestDownstreamCronJob')
+        call_command('runcrons', 'test_crons.TestUpstreamCronJob')
+        self.assertEqual(CronJobLog.objects.filter(code='test_downstream').count(), 1)
+        call_command('runcrons', 'test_crons.TestOtherUpstreamCronJob')
+        self.assertEqual(CronJobLog.objects.filter(code='test_downstream').count(), 2)
+
+        cron_classes = [type('Job%s' % code, (CronJobBase,), {'code': code, 'DEPENDS_ON': [upstream]}) for code, upstream in (
+            ('a', 'c'), ('b', 'a'), ('c', 'b'),
+        )]
+        with self.assertRaises(ImproperlyConfigured) as context:
+            CronJobGraph(cron_classes)
+        self.assertIn('DEPENDS_ON cycle: a -> c -> b -> a', str(context.exception))
+        with self.assertRaises(ImproperlyConfigured):
+            CronJobGraph(cron_classes[:1])
+
+    def test_sharded_job(self):
+        started = time()
+        call_command('runcrons', 'test_crons.TestShardedCronJob')
+        # The shards ran in parallel
+        self.assertLess(time() - started, 1.5)
+        logs = dict((log.code, log) for log in CronJobLog.objects.all())
+        self.assertEqual(sorted(logs), ['test_sharded', 'test_sharded.0', 'test_sharded.1', 'test_sharded.2', 'test_sharded.3'])
+        self.assertEqual(logs['test_sharded.1'].message, 'shard 1 done\n...\nshard 1\n')
+        self.assertFalse(logs['test_sharded.3'].is_success)
+        self.assertIn('shard 3 failed', logs['test_sharded.3'].message)
+        self.assertFalse(logs['test_sharded'].is_success)
+        self.assertTrue(logs['test_sharded'].message.startswith('4 shards: 3 succeeded, 1 failed (3)'))
+        self.assertIn('shard 2\n', logs['test_sharded'].message)
+
+        # The output of shards run in child processes is kept
+        call_command('runcrons', 'test_crons.TestTimeoutShardedCronJob')
+        self.assertTrue(CronJobLog.objects.get(code='test_timeout_sharded.1').message.endswith('shard 1\n'))
+        self.assertTrue(CronJobLog.objects.get(code='test_timeout_sharded').message.endswith('shard 0\nshard 1\nshard 2\n'))
+
+        # Shards too long for the code of the logs are hashed
+        manager = CronJobManager(get_class('test_crons.TestShardedCronJob'))
+        manager.cron_job = manager.cron_job_class()
+        shard_class = manager.get_shard_class('tenant-' + 'x' * 80)
+        self.assertEqual(len(shard_class.code), len('test_sharded.') + 12)
+        self.assertNotEqual(manager.get_shard_class('tenant-' + 'y' * 80).code, shard_class.code)
+        self.assertEqual(manager.get_shard_class('tenant').code, 'test_sharded.tenant')
+        with CronJobManager(shard_class) as shard_manager:
+            shard_manager.run(force=True)
+        self.assertTrue(CronJobLog.objects.get(code=shard_class.code).is_success)
+        manager.cron_job.code = 'c' * 63
+        codes = set(manager.get_shard_class(shard).code for shard in range(10))
+        self.assertEqual(len(codes), 10)
+        self.assertEqual(set(len(code) for code in codes), set([64]))
+        self.assertTrue(all(code.startswith('c' * 51 + '.') for code in codes))
+
+        # A shard still locked by a previous run is skipped
+        lock = CacheLock(type(str('TestShardedCronJob_0'), (object,), {'code': 'test_sharded.0'}), True)
+        self.assertTrue(lock.lock())
+        try:
+            call_command('runcrons', 'test_crons.TestShardedCronJob')
+        finally:
+            lock.release()
+        self.assertEqual(CronJobLog.objects.filter(code='test_sharded.0').count(), 1)
+        self.assertEqual(CronJobLog.objects.filter(code='test_sharded.1').count(), 2)
+        self.assertTrue(CronJobLog.objects.filter(code='test_sharded').latest('id').message.startswith(
+            '4 shards: 2 succeeded, 2 failed (0, 3)'
+        ))
+
+    def test_registry(self):
+        self.assertEqual(apps.get_app_config('django_cron').__class__.__name__, 'DjangoCronConfig')
+        registry = get_registry()
+        self.assertIs(get_registry(), registry)
+        self.assertIs(registry.lock_class, CacheLock)
+        self.assertEqual(len(registry.cron_classes), 6)
+        self.assertIs(get_class(self.success_cron), class_cache[self.success_cron])
+
+        with override_settings(CRON_CLASSES=[self.success_cron, {
+            'class': 'test_lazy_crons.TestLazyCronJob', 'code': 'test_lazy', 'schedule': {'run_every_mins': 5}
+        }], DJANGO_CRON_LOCK_BACKEND='django_cron.backends.lock.file.FileLock'):
+            registry = get_registry()
+            self.assertEqual([x.code for x in registry.cron_classes], ['test_success_cron_job', 'test_lazy'])
+            self.assertIsInstance(registry.cron_classes[1], LazyCronJob)
+            self.assertEqual(registry.lock_class.__name__, 'FileLock')
+            self.assertIs(CronJobManager.get_lock_class(), registry.lock_class)
+            self.assertEqual(get_cron_class('test_lazy_crons.TestLazyCronJob').code, 'test_lazy')
+        self.assertIsNot(get_registry(), registry)
+
+        for entries, lock_backend, error in (
+            ([self.success_cron, 'test_crons.TestSucessCronJob'], None, 'Duplicate codes in CRON_CLASSES: test_success_cron_job'),
+            ([self.does_not_exist_cron], None, 'Invalid CRON_CLASSES entry'),
+            (['django_cron.models.CronJobLog'], None, 'is not a subclass of CronJobBase'),
+            ([{'class': 'test_lazy_crons.TestLazyCronJob', 'code': 'test_lazy'}], None, 'Invalid CRON_CLASSES entry'),
+            ([self.success_cron], 'django_cron.backends.lock.Missing', 'Invalid DJANGO_CRON_LOCK_BACKEND'),
+            ([self.success_cron], 'django_cron.models.CronJobLog', 'is not a subclass of DjangoCronJobLock'),
+        ):
+            with self.assertRaises(ImproperlyConfigured) as context:
+                CronJobRegistry(entries, lock_backend)
+            self.assertIn(error, str(context.exception))
+
+        with self.assertRaises(ImproperlyConfigured) as context:
+            CronJobRegistry([self.success_cron], 'django_cron.backends.lock.file.FileLock', 60)
+        self.assertIn('DJANGO_CRON_LEADER_LEASE_TTL needs a lock backend supporting leases, FileLock does not', str(context.exception))
+        for lock_backend in (None, 'django_cron.backends.lock.database.DatabaseLock'):
+            CronJobRegistry([self.success_cron], lock_backend, 60)
+
+    @override_settings(DJANGO_CRON_METRICS_BACKEND='django_cron.metrics.InMemoryMetrics')
+    def test_metrics(self):
+        metrics = get_metrics()
+        metrics.reset()
+        call_command('runcrons', self.success_cron, self.error_cron)
+        self.assertEqual(metrics.get_counter('django_cron.runs'), 2)
+        self.assertEqual(metrics.get_counter('django_cron.failures'), 1)
+        self.assertEqual(metrics.get_counter('django_cron.failures', code='test_error_cron_job'), 1)
+        self.assertEqual(len(metrics.get_observations('django_cron.job_duration', code='test_success_cron_job')), 1)
+        self.assertEqual(len(metrics.get_observations('django_cron.schedule_evaluation')), 1)
+
+        lock = CacheLock(get_class(self.success_cron), True)
+        self.assertTrue(lock.lock())
+        try:
+            call_command('runcrons', self.success_cron, force=True)
+        finally:
+            lock.release()
+        self.assertEqual(metrics.get_counter('django_cron.lock_contention', code='test_success_cron_job'), 1)
+        self.assertEqual(metrics.get_counter('django_cron.runs'), 2)
+
+        with override_settings(DJANGO_CRON_QUEUE='django_cron.queue.LocalQueue'):
+            call_command('runcrons', self.success_cron, force=True)
+            call_command('cronworker', once=True)
+        self.assertEqual(metrics.get_counter('django_cron.enqueued'), 1)
+        self.assertEqual(len(metrics.get_observations('django_cron.queue_lag', code='test_success_cron_job')), 1)
+        self.assertEqual(metrics.get_counter('django_cron.runs'), 3)
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'async def needs Python 3.5')
+    def test_async_jobs(self):
+        started = time()
+        call_command(
+            'runcrons', 'test_async_crons.TestAsyncCronJob', 'test_async_crons.TestAsyncOtherCronJob',
+            'test_async_crons.TestAsyncTimeoutCronJob', self.success_cron
+        )
+        # The async jobs ran concurrently
+        self.assertLess(time() - started, 1.9)
+        logs = dict((log.code, log) for log in CronJobLog.objects.all())
+        self.assertEqual(len(logs), 4)
+        self.assertTrue(logs['test_async_cron_job'].is_success)
+        self.assertEqual(logs['test_async_other_cron_job'].message, 'slept 1 second')
+        self.assertFalse(logs['test_async_timeout_cron_job'].is_success)
+        self.assertTrue(logs['test_async_timeout_cron_job'].message.startswith('Timed out after 0.1 seconds'))
+
+        # Without runcrons, async jobs run on their own event loop
+        with CronJobManager(get_class('test_async_crons.TestAsyncCronJob')) as manager:
+            manager.run(force=True)
+        self.assertEqual(CronJobLog.objects.filter(code='test_async_cron_job', is_success=True).count(), 2)
+
+    def test_timeout(self):
+        started = time()
+        call_command('runcrons', 'test_crons.TestTimeoutCronJob', 'test_crons.TestTimeoutQueryCronJob', self.success_cron)
+        self.assertLess(time() - started, 2)
+
+        timed_out = CronJobLog.objects.get(code='test_timeout')
+        self.assertFalse(timed_out.is_success)
+        self.assertEqual(timed_out.message, 'Timed out after 0.5 seconds, the job was killed.')
+        # The job process used its own database connection
+        self.assertEqual(CronJobLog.objects.get(code='test_timeout_query').message, '1 logs')
+        self.assertTrue(CronJobLog.objects.get(code='test_success_cron_job').is_success)
+
+        # The lock was released
+        lock = CacheLock(get_class('test_crons.TestTimeoutCronJob'), True)
+        self.assertTrue(lock.lock())
+        lock.release()
+
+    @unittest.skipIf(sys.version_info < (3, 4), 'start methods were added in Python 3.4')
+    def test_timeout_spawn_start_method(self):
+        start_method = multiprocessing.get_start_method(allow_none=True)
+        multiprocessing.set_start_method('spawn', force=True)
+        try:
+            call_command('runcrons', 'test_crons.TestTimeoutQueryCronJob')
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+        # The job process was forked anyway
+        self.assertEqual(CronJobLog.objects.get(code='test_timeout_query').message, '0 logs')
+
+    @override_settings(DJANGO_CRON_LOG_BUFFER_INTERVAL=60)
+    def test_log_buffer(self):
+        with CaptureQueriesContext(db.connection) as queries:
+            call_command('runcrons', self.success_cron, self.five_mins_cron, self.error_cron)
+        inserts = [q['sql'] for q in queries if 'INSERT INTO "django_cron_cronjoblog"' in q['sql']]
+        # One bulk insert of the successes, the failure was saved right away
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(CronJobLog.objects.count(), 3)
+
+        states = CronJobState.objects.in_bulk(['test_success_cron_job', 'test_run_every_mins', 'test_error_cron_job'])
+        for code in ('test_success_cron_job', 'test_run_every_mins'):
+            self.assertEqual(states[code].last_success, CronJobLog.objects.get(code=code))
+        self.assertEqual(states['test_error_cron_job'].consecutive_failures, 1)
+
+        # The buffered runs are seen by the scheduler
+        call_command('runcrons', self.five_mins_cron)
+        self.assertEqual(CronJobLog.objects.count(), 3)
+
+    def test_parallel_workers(self):
+        logs_count = CronJobLog.objects.all().count()
+        started = time()
+        call_command('runcrons', self.wait_3sec_cron, self.wait_3sec_other_cron, workers=2)
+        self.assertLess(time() - started, 5)
+        self.assertEqual(CronJobLog.objects.all().count(), logs_count + 2)
+
+    def assert_single_lock_holder(self):
+        cron_class = get_class(self.wait_3sec_cron)
+        started = threading.Event()
+        holders = []
+
+        def take_lock():
+            lock = CacheLock(cron_class, True)
+            started.wait()
+            if lock.lock():
+                holders.append(lock)
+
+        threads = [threading.Thread(target=take_lock) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        started.set()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(len(holders), 1)
+
+        # Only the owner can release the lock
+        other = CacheLock(cron_class, True)
+        other.release()
+        self.assertFalse(other.lock())
+        self.assertFalse(other.refresh())
+        self.assertTrue(holders[0].refresh())
+        holders[0].release()
+        self.assertTrue(other.lock())
+        other.release()
+
+    @override_settings(
+        CACHES={'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        DJANGO_CRON_CACHE='locmem'
+    )
+    def test_cache_lock_locmem_stress(self):
+        self.assert_single_lock_holder()
+
+    def test_cache_lock_file_based_stress(self):
+        self.assert_single_lock_holder()
+
+    @override_settings(DJANGO_CRON_LOCK_REFRESH_INTERVAL=0.1, DJANGO_CRON_LOCK_TIME=1)
+    def test_cache_lock_refresh(self):
+        cron_class = get_class(self.wait_3sec_cron)
+        with CacheLock(cron_class, True):
+            sleep(1.5)
+            # Refreshed while the job was running, the lock didn't expire
+            self.assertFalse(CacheLock(cron_class, True).lock())
+        lock = CacheLock(cron_class, True)
+        self.assertTrue(lock.lock())
+        lock.release()
+
+    @override_settings(
+        CACHES={'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        DJANGO_CRON_CACHE='locmem',
+        DJANGO_CRON_BATCH_LOCKS=True
+    )
+    def test_cache_lock_many(self):
+        cron_classes = [get_class(x) for x in (self.success_cron, self.five_mins_cron, self.error_cron)]
+        held = CacheLock(cron_classes[1], True)
+        self.assertTrue(held.lock())
+
+        locks = CacheLock.lock_many(cron_classes, True)
+        self.assertEqual([lock.locked for lock in locks], [True, False, True])
+        CacheLock.release_many(locks)
+        self.assertFalse(any(lock.locked for lock in locks))
+        # Only the owner's lock is still there
+        self.assertFalse(CacheLock(cron_classes[1], True).lock())
+        lock = CacheLock(cron_classes[0], True)
+        self.assertTrue(lock.lock())
+        lock.release()
+
+        call_command('runcrons', self.success_cron, self.five_mins_cron, self.error_cron, force=True)
+        self.assertEqual(sorted(CronJobLog.objects.values_list('code', flat=True)), ['test_error_cron_job', 'test_success_cron_job'])
+        # The locks of finished jobs were released
+        locks = CacheLock.lock_many(cron_classes[::2], True)
+        self.assertTrue(all(lock.locked for lock in locks))
+        CacheLock.release_many(locks)
+        held.release()
+
+    def test_cache_lock_cas(self):
+        cache = PyLibMCCache.__new__(PyLibMCCache)
+        super(PyLibMCCache, cache).__init__('', {}, library=None, value_not_found_exception=KeyError)
+        cache.__dict__['_cache'] = client = CasClient()
+        cron_class = get_class(self.success_cron)
+        lock = CacheLock(cron_class, True, cache=cache)
+        self.assertTrue(lock.lock())
+
+        # The lock is changed between the owner check and the delete
+        gets = client.gets
+
+        def gets_then_expire(key):
+            value = gets(key)
+            client.values.pop(key)
+            self.assertTrue(CacheLock(cron_class, True, cache=cache).lock())
+            return value
+        client.gets = gets_then_expire
+        lock.release()
+        client.gets = gets
+        # The lock of the next run is still there
+        self.assertFalse(CacheLock(cron_class, True, cache=cache).lock())
+        self.assertFalse(lock.is_owner())
+
+        other = CacheLock(cron_class, True, cache=cache)
+        other.token = client.get(cache.make_key(other.lock_name))[0]
+        other.locked = True
+        other.release()
+        self.assertEqual(client.values, {})
+
+    @override_settings(
+        DJANGO_CRON_LOCK_BACKEND='django_cron.backends.lock.database.DatabaseLock',
+        DJANGO_CRON_BATCH_LOCKS=True
+    )
+    def test_database_lock_many(self):
+        cron_classes = [get_class(x) for x in (self.success_cron, self.error_cron)]
+        locks = DatabaseLock.lock_many(cron_classes, True)
+        if db.connection.vendor in DatabaseLock.ADVISORY_LOCK_VENDORS:
+            # Taken by the connection of the job's thread when entered
+            self.assertFalse(any(lock.batched or lock.locked for lock in locks))
+        else:
+            self.assertTrue(all(lock.locked for lock in locks))
+        DatabaseLock.release_many(locks)
+
+        call_command('runcrons', self.success_cron, self.error_cron, workers=2, force=True)
+        self.assertEqual(CronJobLog.objects.count(), 2)
+        # Released by the threads of the jobs
+        self.assertEqual(CronJobLock.objects.count(), 0)
+        for lock in DatabaseLock.lock_many(cron_classes, True):
+            with lock:
+                pass
+
+    @override_settings(
+        CACHES={'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        DJANGO_CRON_CACHE='locmem'
+    )
+    def test_leader_lease(self):
+        for lock_class in (CacheLock, DatabaseLock):
+            with freeze_time("2014-01-01 00:00:00"):
+                node_a = LeaderLease(60, 'node-a', lock_class)
+                node_b = LeaderLease(60, 'node-b', lock_class)
+                self.assertTrue(node_a.is_leader())
+                self.assertFalse(node_b.is_leader())
+            with freeze_time("2014-01-01 00:00:50"):
+                self.assertTrue(node_a.is_leader())
+            with freeze_time("2014-01-01 00:01:40"):
+                # Renewed at 00:00:50, node-a still holds the lease
+                self.assertFalse(node_b.is_leader())
+            with freeze_time("2014-01-01 00:02:00"):
+                # node-a stopped renewing it
+                self.assertTrue(node_b.is_leader())
+                self.assertFalse(node_a.is_leader())
+
+        with override_settings(DJANGO_CRON_LEADER_LEASE_TTL=60, DJANGO_CRON_NODE_NAME='node-a'):
+            with freeze_time("2014-01-01 00:02:30"):
+                call_command('runcrons', self.five_mins_cron)
+                self.assertEqual(CronJobLog.objects.count(), 0)
+                # Forced runs ignore the leader
+                call_command('runcrons', self.five_mins_cron, force=True)
+                self.assertEqual(CronJobLog.objects.count(), 1)
+            with freeze_time("2014-01-01 00:08:00"):
+                call_command('runcrons', self.five_mins_cron)
+                self.assertEqual(CronJobLog.objects.count(), 2)
+                self.assertFalse(LeaderLease(60, 'node-b').is_leader())
+
+    @override_settings(DJANGO_CRON_LOCK_BACKEND='django_cron.backends.lock.database.DatabaseLock')
+    def test_database_locking_backend(self):
+        logs_count = CronJobLog.objects.all().count()
+        t = threading.Thread(target=self.run_cronjob_in_thread, args=(logs_count,))
+        t.daemon = True
+        t.start()
+        # this shouldn't get running
+        sleep(0.1)  # to avoid race condition
+        call_command('runcrons', self.wait_3sec_cron)
+        t.join(10)
+        self.assertEqual(CronJobLog.objects.all().count(), logs_count + 1)
+        self.assertEqual(CronJobLock.objects.count(), 0)
+
+    @override_settings(DJANGO_CRON_LOCK_TIME=60)
+    def test_database_lock_table(self):
+        if db.connection.vendor in DatabaseLock.ADVISORY_LOCK_VENDORS:
+            # Advisory locks are re-entrant within a connection
+            self.skipTest('%s uses advisory locks' % db.connection.vendor)
+
+        cron_class = get_class(self.wait_3sec_cron)
+        lock = DatabaseLock(cron_class, True)
+        other = DatabaseLock(cron_class, True)
+        with CaptureQueriesContext(db.connection) as queries:
+            self.assertTrue(lock.lock())
+        self.assertEqual(len([q for q in queries if 'cronjoblock' in q['sql']]), 1)
+        self.assertFalse(other.lock())
+
+        # Only the owner can release the lock
+        other.release()
+        self.assertFalse(other.lock())
+        self.assertFalse(other.refresh())
+        self.assertTrue(lock.refresh())
+        with CaptureQueriesContext(db.connection) as queries:
+            lock.release()
+        self.assertEqual(len([q for q in queries if 'cronjoblock' in q['sql']]), 1)
+        self.assertTrue(other.lock())
+
+        # Expired locks are taken over
+        with freeze_time(timezone.now() + timedelta(seconds=61)):
+            self.assertTrue(lock.lock())
+        other.release()
+        self.assertEqual(CronJobLock.objects.get().token, lock.token)
+        lock.release()
+        self.assertEqual(CronJobLock.objects.count(), 0)
+
     # TODO: this test doesn't pass - seems that second cronjob is locking file
     # however it should throw an exception that file is locked by other cronjob
     # @override_settings(
@@ -170,6 +973,79 @@ class TestCase(unittest.TestCase):
 
         self.assertEqual(CronJobLog.objects.all().count(), logs_count + 11)
 
+    @override_settings(ADMINS=[('admin', 'admin@example.com')], FAILED_RUNS_CRONJOB_EMAIL_PREFIX='[cron] ')
+    def test_failed_runs_notification_email(self):
+        mail.outbox = []
+        for i in range(9):
+            call_command('runcrons', self.error_cron, force=True)
+        call_command('runcrons', self.test_failed_runs_notification_cron, force=True)
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('runcrons', self.error_cron, force=True)
+        call_command('runcrons', self.test_failed_runs_notification_cron, force=True)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, '[cron] test_error_cron_job failed 10 times in a row!')
+        self.assertEqual(mail.outbox[0].body.count('Job ran at'), 10)
+
+    @override_settings(ADMINS=[('admin', 'admin@example.com')], CRON_CLASSES=[
+        {'class': 'test_lazy_crons.TestLazyCronJob', 'code': 'test_lazy', 'schedule': {'run_every_mins': 5}, 'MIN_NUM_FAILURES': 2},
+        {'class': 'test_missing_crons.TestMissingCronJob', 'code': 'test_lazy_missing', 'schedule': {'run_every_mins': 5}},
+        {'class': 'test_lazy_crons.TestProfiledCronJob', 'code': 'test_profiled', 'schedule': {'run_every_mins': 5}, 'MIN_NUM_FAILURES': None},
+    ])
+    def test_failed_runs_notification_lazy_classes(self):
+        sys.modules.pop('test_lazy_crons', None)
+        mail.outbox = []
+        now = timezone.now()
+        for code, failures in (('test_lazy', 2), ('test_lazy_missing', 10)):
+            for i in range(failures):
+                CronJobLog.objects.create(code=code, start_time=now, end_time=now, is_success=False)
+        # The declared MIN_NUM_FAILURES is used without importing the module
+        FailedRunsNotificationCronJob().do()
+        self.assertNotIn('test_lazy_crons', sys.modules)
+        # The class that can't be imported is checked with the default MIN_NUM_FAILURES
+        self.assertEqual(mail.outbox[0].subject, '2 crons failed many times in a row: test_lazy, test_lazy_missing')
+
+        call_command('prunecronlogs', stdout=OutBuffer())
+        # Imported for LOG_RETENTION_DAYS and LOG_RETENTION_RUNS, not declared
+        self.assertIn('test_lazy_crons', sys.modules)
+
+    def test_prune_cron_logs(self):
+        code = get_class(self.five_mins_cron).code
+        start = datetime(2014, 1, 1)
+        for i in range(20):
+            start_time = start + timedelta(minutes=i)
+            CronJobLog.objects.create(
+                code=code,
+                start_time=start_time,
+                end_time=start_time,
+                is_success=i not in (2, 12),
+            )
+            # Interleaved rows of another code, all kept
+            for j in range(10):
+                CronJobLog.objects.create(code='other', start_time=start, end_time=start, is_success=True)
+
+        with freeze_time("2014-01-02 00:00:00"):
+            with CaptureQueriesContext(db.connection) as queries:
+                call_command('prunecronlogs', runs=5, batch_size=3, stdout=OutBuffer())
+
+        # 5 latest runs + latest failure, other codes untouched
+        self.assertEqual(CronJobLog.objects.filter(code=code).count(), 6)
+        self.assertFalse(CronJobLog.objects.filter(code=code, start_time=start + timedelta(minutes=2)).exists())
+        self.assertTrue(CronJobLog.objects.filter(code=code, start_time=start + timedelta(minutes=12)).exists())
+        self.assertEqual(CronJobLog.objects.filter(code='other').count(), 200)
+        # 14 rows deleted in batches of 3, without loading them
+        self.assertEqual(len([q for q in queries if 'DELETE FROM' in q['sql']]), 5)
+        self.assertFalse([q for q in queries if '"message"' in q['sql']])
+        self.assertLess(len(queries), 30)
+        CronJobLog.objects.filter(code='other').exclude(pk=CronJobLog.objects.filter(code='other').first().pk).delete()
+
+        with freeze_time("2014-01-20 00:00:00"):
+            call_command('prunecronlogs', days=7, stdout=OutBuffer())
+
+        # Only the latest success and failure of each code are left
+        self.assertEqual(CronJobLog.objects.filter(code=code).count(), 2)
+        self.assertEqual(CronJobLog.objects.filter(code='other').count(), 1)
+
     def test_humanize_duration(self):
         test_subjects = (
             (timedelta(days=1, hours=1, minutes=1, seconds=1), '1 day, 1 hour, 1 minute, 1 second'),
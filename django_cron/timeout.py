@@ -0,0 +1,113 @@
+import multiprocessing
+import os
+import signal
+import traceback
+
+from django.db import connections
+
+
+# Database connections inherited from the parent process, see detach_connections
+inherited_connections = []
+
+
+class CronJobTimeout(Exception):
+    pass
+
+
+class CronJobSubprocessError(Exception):
+    pass
+
+
+def can_enforce_timeout():
+    """
+    Timeouts are enforced by running do() in a forked process, not available on Windows.
+    """
+    if hasattr(multiprocessing, 'get_all_start_methods'):
+        return 'fork' in multiprocessing.get_all_start_methods()
+    return hasattr(os, 'fork')
+
+
+def get_fork_context():
+    """
+    Returns the multiprocessing context forking the job process, whatever
+    the default start method: the job, its manager and their locks can't
+    be pickled for spawn or forkserver.
+    """
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    # Python 2 always forks
+    return multiprocessing
+
+
+def detach_connections():
+    """
+    Makes Django open new database connections in a forked process.
+
+    The connections inherited from the parent are not closed, that would
+    close them for the parent too: references are kept until the process
+    exits (without running finalizers, see multiprocessing.Process).
+    """
+    for connection in connections.all():
+        if connection.connection is not None:
+            inherited_connections.append(connection.connection)
+            connection.connection = None
+
+
+def run_job(do, pipe):
+    # The parent may have replaced the default handler (runcrons --daemon)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    detach_connections()
+    try:
+        pipe.send((True, do()))
+    except Exception:
+        pipe.send((False, traceback.format_exc()))
+    finally:
+        connections.close_all()
+
+
+def run_with_timeout(do, timeout):
+    """
+    Calls do() in a child process and returns its result.
+
+    Raises CronJobTimeout after killing the child if it's still running after
+    `timeout` seconds, and CronJobSubprocessError with the traceback if do()
+    raised an exception.
+
+    Only the calling thread is forked: locks held by other threads at that
+    moment (logging handlers...) are never released in the child, which
+    then hangs until it's killed as timed out.
+    """
+    context = get_fork_context()
+    reader, writer = context.Pipe(duplex=False)
+    process = context.Process(target=run_job, args=(do, writer))
+    process.daemon = True
+    process.start()
+    writer.close()
+
+    outcome = None
+    timed_out = False
+    try:
+        if reader.poll(timeout):
+            outcome = reader.recv()
+        else:
+            timed_out = True
+    except EOFError:
+        pass
+    finally:
+        reader.close()
+        if process.is_alive():
+            process.terminate()
+            process.join(1)
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+    if timed_out:
+        raise CronJobTimeout('Timed out after %s seconds, the job was killed.' % timeout)
+    if outcome is None:
+        raise CronJobSubprocessError('The job process exited with code %s.' % process.exitcode)
+
+    success, result = outcome
+    if not success:
+        raise CronJobSubprocessError(result)
+    return result
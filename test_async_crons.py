@@ -0,0 +1,21 @@
+import asyncio
+
+from django_cron import CronJobBase, Schedule
+
+
+class TestAsyncCronJob(CronJobBase):
+    code = 'test_async_cron_job'
+    schedule = Schedule(run_every_mins=0)
+
+    async def do(self):
+        await asyncio.sleep(1)
+        return 'slept 1 second'
+
+
+class TestAsyncOtherCronJob(TestAsyncCronJob):
+    code = 'test_async_other_cron_job'
+
+
+class TestAsyncTimeoutCronJob(TestAsyncCronJob):
+    code = 'test_async_timeout_cron_job'
+    TIMEOUT_SECONDS = 0.1
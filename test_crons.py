@@ -1,6 +1,6 @@
 from time import sleep
 
-from django_cron import CronJobBase, Schedule
+from django_cron import CronJobBase, Schedule, ShardedCronJobBase
 
 
 class TestSucessCronJob(CronJobBase):
@@ -41,3 +41,101 @@ class Wait3secCronJob(CronJobBase):
 
     def do(self):
         sleep(3)
+
+
+class Wait3secOtherCronJob(Wait3secCronJob):
+    code = 'test_wait_3_seconds_other'
+
+
+class TestCronExpressionCronJob(CronJobBase):
+    code = 'test_cron_expression'
+    schedule = Schedule(cron_expression='15,45 * * * *')
+
+    def do(self):
+        pass
+
+
+class TestTimeoutCronJob(Wait3secCronJob):
+    code = 'test_timeout'
+    TIMEOUT_SECONDS = 0.5
+
+
+class TestTimeoutQueryCronJob(CronJobBase):
+    code = 'test_timeout_query'
+    schedule = Schedule(run_every_mins=0)
+    TIMEOUT_SECONDS = 10
+
+    def do(self):
+        from django_cron.models import CronJobLog
+        return '%s logs' % CronJobLog.objects.count()
+
+
+class TestQueryCronJob(CronJobBase):
+    code = 'test_query'
+    schedule = Schedule(run_every_mins=0)
+
+    def do(self):
+        from django_cron.models import CronJobLog
+        CronJobLog.objects.count()
+        CronJobLog.objects.exists()
+
+
+class TestOutputCronJob(CronJobBase):
+    code = 'test_output'
+    schedule = Schedule(run_every_mins=0)
+
+    def do(self):
+        for i in range(5000):
+            self.output.write('line %s\n' % i)
+        return 'done'
+
+
+class TestTimeoutOutputCronJob(TestOutputCronJob):
+    code = 'test_timeout_output'
+    TIMEOUT_SECONDS = 10
+
+
+class TestUpstreamCronJob(CronJobBase):
+    code = 'test_upstream'
+    schedule = Schedule(run_every_mins=0)
+
+    def do(self):
+        sleep(1)
+
+
+class TestOtherUpstreamCronJob(TestUpstreamCronJob):
+    code = 'test_other_upstream'
+
+
+class TestDownstreamCronJob(CronJobBase):
+    code = 'test_downstream'
+    DEPENDS_ON = ['test_upstream', 'test_other_upstream']
+
+    def do(self):
+        pass
+
+
+class TestAfterErrorCronJob(CronJobBase):
+    code = 'test_after_error'
+    DEPENDS_ON = ['test_error_cron_job']
+
+    def do(self):
+        pass
+
+
+class TestShardedCronJob(ShardedCronJobBase):
+    code = 'test_sharded'
+    schedule = Schedule(run_every_mins=0)
+    SHARDS = 4
+
+    def do(self, shard):
+        sleep(0.5)
+        if shard == 3:
+            raise Exception('shard 3 failed')
+        self.output.write('shard %s\n' % shard)
+        return 'shard %s done' % shard
+
+
+class TestTimeoutShardedCronJob(TestShardedCronJob):
+    code = 'test_timeout_sharded'
+    TIMEOUT_SECONDS = 10
@@ -0,0 +1,22 @@
+from django_cron import CronJobBase, Schedule
+
+
+class TestLazyCronJob(CronJobBase):
+    """
+    Declared in CRON_CLASSES with its code and schedule,
+    this module is only imported when the job is due.
+    """
+
+    def do(self):
+        return 'ran lazily'
+
+
+class TestProfiledCronJob(CronJobBase):
+    """
+    Listed by path in CRON_CLASSES, imported by the registry.
+    """
+    code = 'test_profiled'
+    schedule = Schedule(run_every_mins=5)
+
+    def do(self):
+        pass